@@ -0,0 +1,287 @@
+'''offline benchmarks of the service against a local fake Salesforce.
+
+Each scenario starts the service in a fresh process(see run_service.py) with the scenario's env vars on top of the
+current environment, runs its requests --repeat times after a warm-up request that logs in and loads the describe
+metadata, and reports throughput, p50/p99 request latency, peak RSS of the service process and the number of calls
+the fake Salesforce received. The sesamify scenarios run in the benchmark process instead and time only the
+conversion of --sesamify-rows generated rows of --width extra fields, sesamify_baseline with the per-field schema lookup
+that sesamify used before its converters were compiled per sobject.
+
+    python benchmark/benchmark.py --rows 1000000 --width 50 --scenario get_full
+    python benchmark/benchmark.py --latency 0.05 --json results.json
+'''
+from collections import OrderedDict
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import requests
+
+from dateutil.parser import parse
+
+from fake_salesforce import FakeSalesforce, format_datetime
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, "..", "service"))
+SESAMIFY_BATCH_SIZE = 10000
+
+
+def percentile(values, p):
+    '''nearest-rank percentile'''
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(p / 100.0 * len(values) + 0.5)) - 1))]
+
+def peak_rss_mb(pid):
+    '''peak resident set size of the process in MB, None where /proc is not available'''
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        return None
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def count_entities(response):
+    '''counts the entities of a streamed JSON array response without parsing it'''
+    marker = b'"_id"'
+    count = 0
+    tail = b""
+    for chunk in response.iter_content(65536):
+        data = tail + chunk
+        count += data.count(marker)
+        # keep the bytes that may hold the beginning of a marker split over two chunks
+        tail = data[-(len(marker) - 1):]
+        if marker in tail:
+            tail = b""
+    return count
+
+def make_entities(count, width):
+    return [dict([("_id", f"ext-{i}"), ("Ext__c", f"ext-{i}"), ("Name", f"Account {i}")] +
+        [(f"Field{k}__c", f"value {i}") for k in range(0, width, 5)]) for i in range(count)]
+
+
+# scenarios, each returns a list of (seconds, items) samples
+
+def run_get(ctx, path):
+    samples = []
+    for _ in range(ctx.args.repeat):
+        started_at = time.perf_counter()
+        with ctx.http.get(ctx.url + path, stream=True) as response:
+            response.raise_for_status()
+            items = count_entities(response)
+        samples.append((time.perf_counter() - started_at, items))
+    return samples
+
+def run_get_full(ctx):
+    return run_get(ctx, "/Account")
+
+def run_get_since(ctx):
+    since = format_datetime(ctx.fake.modstamp(int(ctx.fake.rows * (1 - ctx.args.since_ratio))))
+    return run_get(ctx, "/Account?since=" + requests.utils.quote(since))
+
+def run_post(ctx):
+    body = json.dumps(make_entities(ctx.args.entities, ctx.fake.width)).encode("utf-8")
+    samples = []
+    for _ in range(ctx.args.repeat):
+        started_at = time.perf_counter()
+        response = ctx.http.post(ctx.url + "/Account", data=body, headers={"Content-Type": "application/json"})
+        response.raise_for_status()
+        samples.append((time.perf_counter() - started_at, ctx.args.entities))
+    return samples
+
+def run_valueset_get(ctx):
+    samples = []
+    for _ in range(ctx.args.repeat):
+        started_at = time.perf_counter()
+        response = ctx.http.get(ctx.url + "/ValueSet")
+        response.raise_for_status()
+        samples.append((time.perf_counter() - started_at, len(response.json())))
+    return samples
+
+def run_valueset_post(ctx):
+    values = [{"valueName": f"value{i}", "label": f"Value {i}", "default": False, "isActive": True}
+        for i in range(ctx.fake.valueset_size + 1)]
+    body = [{"path": path, "data": values} for path in valueset_list(ctx.args.valuesets).values()]
+    samples = []
+    for _ in range(ctx.args.repeat):
+        started_at = time.perf_counter()
+        response = ctx.http.post(ctx.url + "/ValueSet", json=body)
+        response.raise_for_status()
+        samples.append((time.perf_counter() - started_at, len(body)))
+    return samples
+
+def run_sesamify_rows(ctx, sesamify):
+    '''times sesamify on the generated rows, which are generated in batches outside the timing'''
+    import service
+    names = [f["name"] for f in ctx.fake.fields]
+    samples = []
+    for _ in range(ctx.args.repeat):
+        service._convert_datetime_value.cache_clear()
+        seconds = 0.0
+        for start in range(0, ctx.args.sesamify_rows, SESAMIFY_BATCH_SIZE):
+            rows = [ctx.fake.record(i, names) for i in range(start, min(ctx.args.sesamify_rows, start + SESAMIFY_BATCH_SIZE))]
+            started_at = time.perf_counter()
+            for row in rows:
+                sesamify(row)
+            seconds += time.perf_counter() - started_at
+        samples.append((seconds, ctx.args.sesamify_rows))
+    return samples
+
+def run_sesamify(ctx):
+    import service
+    data_access = service.DataAccess()
+    data_access._set_fields_metadata("Account", ctx.fake.fields)
+    return run_sesamify_rows(ctx, lambda row: data_access.sesamify(row, "Account"))
+
+def baseline_sesamify(fields, entity):
+    '''sesamify before the converters were compiled per sobject: a schema lookup per property and dateutil parsing'''
+    entity.update({"_id": entity.get("Id")})
+    for property, value in entity.items():
+        schema = [item for item in fields if item.get("name") == property]
+        if value and len(schema) > 0 and "type" in schema[0] and schema[0]["type"] == "datetime":
+            if isinstance(value, str):
+                dt = parse(value)
+                entity[property] = "~t" + '%04d' % dt.year + dt.strftime("-%m-%dT%H:%M:%SZ")
+    entity.update({"_updated": "%s" % (entity.get("SystemModstamp") or entity.get("CreatedDate"))})
+    entity.update({"_deleted": entity.get("IsDeleted")})
+    return entity
+
+def run_sesamify_baseline(ctx):
+    return run_sesamify_rows(ctx, lambda row: baseline_sesamify(ctx.fake.fields, row))
+
+def valueset_list(count):
+    return OrderedDict((f"vs{i}", f"/GlobalValueSet/0Nt{i:015d}" if i % 2 else f"/CustomField/00N{i:015d}")
+        for i in range(count))
+
+def scenarios(args):
+    return OrderedDict([
+        ("get_full", {"run": run_get_full, "env": {}}),
+        ("get_full_bulk", {"run": run_get_full, "env": {"BULK_JOB_POLL_INTERVAL": "0.1",
+            "SF_OBJECTS_CONFIG": {"Account": {"ordered_key_fields": ["Ext__c"], "query_engine": "bulk"}}}}),
+        ("get_since", {"run": run_get_since, "env": {}}),
+        ("post_below_bulk_threshold", {"run": run_post,
+            "env": {"DEFAULT_BULK_SWITCH_THRESHOLD": str(args.entities * 2)}}),
+        ("post_above_bulk_threshold", {"run": run_post,
+            "env": {"DEFAULT_BULK_SWITCH_THRESHOLD": str(max(1, args.entities // 10))}}),
+        ("valueset_get", {"run": run_valueset_get, "env": {}}),
+        ("valueset_post", {"run": run_valueset_post, "env": {}}),
+        ("sesamify", {"run": run_sesamify, "in_process": True}),
+        ("sesamify_baseline", {"run": run_sesamify_baseline, "in_process": True}),
+    ])
+
+
+class Context:
+    def __init__(self, args, fake, url):
+        self.args = args
+        self.fake = fake
+        self.url = url
+        self.http = requests.Session()
+
+def start_service(fake_url, env_overrides):
+    port = free_port()
+    env = dict(os.environ)
+    env.setdefault("SF_OBJECTS_CONFIG", json.dumps({"Account": {"ordered_key_fields": ["Ext__c"]}}))
+    env.update({
+        "PORT": str(port),
+        "FAKE_SALESFORCE_URL": fake_url,
+        "LOGIN_CONFIG": json.dumps({"DOMAIN": "fake", "CLIENT_ID": "benchmark", "CLIENT_SECRET": "benchmark"}),
+    })
+    env.update({k: v if isinstance(v, str) else json.dumps(v) for k, v in env_overrides.items()})
+    process = subprocess.Popen([sys.executable, os.path.join(BENCHMARK_DIR, "run_service.py")], env=env)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            requests.get(url + "/metrics", timeout=1)
+            return process, url
+        except requests.ConnectionError:
+            if process.poll() is not None:
+                raise Exception(f"service exited with {process.returncode}")
+            time.sleep(0.1)
+    process.kill()
+    raise Exception("service did not start")
+
+def run_scenario(name, scenario, args, fake, fake_url):
+    if scenario.get("in_process"):
+        calls_before = fake.api_usage
+        samples = scenario["run"](Context(args, fake, None))
+        rss = None
+    else:
+        env = dict(scenario["env"])
+        env.setdefault("VALUESET_LIST", dict(valueset_list(args.valuesets)))
+        process, url = start_service(fake_url, env)
+        try:
+            ctx = Context(args, fake, url)
+            # logs in and loads the describe metadata without streaming rows
+            ctx.http.get(url + "/Account?since=" + requests.utils.quote("2999-01-01T00:00:00Z")).raise_for_status()
+            calls_before = fake.api_usage
+            samples = scenario["run"](ctx)
+            rss = peak_rss_mb(process.pid)
+        finally:
+            process.terminate()
+            process.wait()
+    seconds = sum(s for s, _ in samples)
+    items = sum(i for _, i in samples)
+    latencies = [s * 1000 for s, _ in samples]
+    return OrderedDict([
+        ("scenario", name),
+        ("requests", len(samples)),
+        ("items", items),
+        ("seconds", round(seconds, 3)),
+        ("items_per_second", round(items / seconds, 1) if seconds else 0),
+        ("p50_ms", round(percentile(latencies, 50), 1)),
+        ("p99_ms", round(percentile(latencies, 99), 1)),
+        ("peak_rss_mb", round(rss, 1) if rss is not None else None),
+        ("salesforce_calls", fake.api_usage - calls_before),
+    ])
+
+def print_table(results):
+    columns = list(results[0].keys())
+    rows = [[str(r[c]) for c in columns] for r in results]
+    widths = [max(len(c), *(len(row[i]) for row in rows)) for i, c in enumerate(columns)]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(v.ljust(w) for v, w in zip(row, widths)))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", action="append", help="scenario to run, can be repeated. Defaults to all.")
+    parser.add_argument("--rows", type=int, default=100000, help="records served by the fake per sobject")
+    parser.add_argument("--width", type=int, default=50, help="extra fields per record")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds every fake Salesforce call takes")
+    parser.add_argument("--page-size", type=int, default=2000, help="records per query page")
+    parser.add_argument("--sesamify-rows", type=int, default=10000, help="rows converted by the sesamify scenarios")
+    parser.add_argument("--entities", type=int, default=10000, help="entities per POST")
+    parser.add_argument("--valuesets", type=int, default=50, help="valuesets in VALUESET_LIST")
+    parser.add_argument("--since-ratio", type=float, default=0.1, help="share of the rows read by get_since")
+    parser.add_argument("--repeat", type=int, default=3, help="requests per scenario")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    fake = FakeSalesforce(rows=args.rows, width=args.width, latency=args.latency, page_size=args.page_size)
+    fake_url = fake.start()
+    all_scenarios = scenarios(args)
+    results = []
+    try:
+        for name in args.scenario or all_scenarios.keys():
+            results.append(run_scenario(name, all_scenarios[name], args, fake, fake_url))
+            print(json.dumps(results[-1]), file=sys.stderr)
+    finally:
+        fake.stop()
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,384 @@
+'''local stand-in for the Salesforce APIs that the service uses, for offline benchmarks.
+Serves OAuth client credentials login, describe, paginated SOQL queries, sObject CRUD, sObject Collections,
+Bulk API 1.0/2.0 jobs, composite requests and the Tooling API. Rows are generated from their index, so any
+number of rows can be served without holding them in memory.'''
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from datetime import datetime, timedelta, timezone
+from urllib import parse as urlparser
+import csv
+import io
+import json
+import re
+import threading
+import time
+import uuid
+
+BASE_DATETIME = datetime(2024, 1, 1, tzinfo=timezone.utc)
+# rows that share a SystemModstamp, so that ties at page boundaries are exercised
+ROWS_PER_TIMESTAMP = 3
+EXTRA_FIELD_TYPES = ["string", "double", "datetime", "boolean", "textarea"]
+
+
+def format_datetime(dt):
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.000+0000")
+
+def parse_soql_datetime(value):
+    value = value.replace("Z", "+00:00")
+    if re.search(r"[+-]\d{4}$", value):
+        value = value[:-2] + ":" + value[-2:]
+    return datetime.fromisoformat(value)
+
+
+class FakeSalesforce:
+    '''the state of the fake org. rows is the number of records per sobject, width the number of extra fields,
+        latency the seconds every call is delayed and page_size the number of records per query page.'''
+    def __init__(self, rows=10000, width=20, latency=0.0, page_size=2000, valueset_size=50, api_limit=5000000):
+        self.rows = rows
+        self.width = width
+        self.latency = latency
+        self.page_size = page_size
+        self.valueset_size = valueset_size
+        self.api_limit = api_limit
+        self.api_usage = 0
+        self.calls = {}
+        self._queries = {}
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self.fields = [
+            {"name": "Id", "type": "id", "length": 18},
+            {"name": "Name", "type": "string", "length": 255},
+            {"name": "Ext__c", "type": "string", "length": 255, "externalId": True},
+            {"name": "CreatedDate", "type": "datetime"},
+            {"name": "SystemModstamp", "type": "datetime"},
+            {"name": "IsDeleted", "type": "boolean"},
+        ] + [{"name": f"Field{i}__c", "type": EXTRA_FIELD_TYPES[i % len(EXTRA_FIELD_TYPES)],
+              "length": 32768 if EXTRA_FIELD_TYPES[i % len(EXTRA_FIELD_TYPES)] == "textarea" else 255}
+             for i in range(width)]
+        self._field_types = {f["name"]: f["type"] for f in self.fields}
+
+    # data
+
+    def record_id(self, index, prefix="001"):
+        return "%s%015d" % (prefix, index)
+
+    def modstamp(self, index):
+        return BASE_DATETIME + timedelta(seconds=index // ROWS_PER_TIMESTAMP)
+
+    def field_value(self, index, name):
+        if name == "Id":
+            return self.record_id(index)
+        if name == "Name":
+            return f"Account {index}"
+        if name == "Ext__c":
+            return f"ext-{index}"
+        if name in ("CreatedDate", "SystemModstamp"):
+            return format_datetime(self.modstamp(index))
+        if name == "IsDeleted":
+            return index % 50 == 0
+        field_type = self._field_types.get(name)
+        if field_type == "double":
+            return index * 1.5
+        if field_type == "datetime":
+            return format_datetime(self.modstamp(index) - timedelta(days=30))
+        if field_type == "boolean":
+            return index % 2 == 0
+        if field_type == "textarea":
+            return f"{name} of record {index}. " * 4
+        if field_type == "string":
+            return f"{name}-{index}"
+        return None
+
+    def record(self, index, field_names, sobject="Account"):
+        row = {"attributes": {"type": sobject, "url": f"/services/data/v60.0/sobjects/{sobject}/{self.record_id(index)}"}}
+        for name in field_names:
+            row[name] = self.field_value(index, name)
+        return row
+
+    def first_index_after(self, modstamp, sf_id=None, inclusive=False):
+        '''returns the index of the first row ordered after (modstamp, sf_id), or at modstamp if inclusive'''
+        seconds = (modstamp - BASE_DATETIME).total_seconds()
+        if seconds < 0:
+            return 0
+        if seconds != int(seconds):
+            return (int(seconds) + 1) * ROWS_PER_TIMESTAMP
+        first_index = int(seconds) * ROWS_PER_TIMESTAMP
+        if inclusive:
+            return first_index
+        if sf_id is None:
+            return first_index + ROWS_PER_TIMESTAMP
+        return max(first_index, min(first_index + ROWS_PER_TIMESTAMP, int(sf_id[3:]) + 1))
+
+    # SOQL
+
+    def run_query(self, soql):
+        '''returns (field names, row indexes) of a query on the generated rows. Supports the conditions that the
+            service generates: since, keyset, range chunks and IN lists.'''
+        m = re.match(r"\s*select\s+(.*?)\s+from\s+(\w+)(.*)$", soql, re.IGNORECASE | re.DOTALL)
+        select, sobject, rest = m.group(1), m.group(2), m.group(3)
+        start, end = 0, self.rows
+        for ts, sf_id in re.findall(r"SystemModstamp>(\S+?) or \(SystemModstamp=\S+? and Id>'(\w+)'\)", rest):
+            start = max(start, self.first_index_after(parse_soql_datetime(ts), sf_id))
+        rest_without_keyset = re.sub(r"\(SystemModstamp>\S+? or \(SystemModstamp=\S+? and Id>'\w+'\)\)", "", rest)
+        for field, operator, ts in re.findall(r"(SystemModstamp|CreatedDate)\s*(>=|<|>)\s*([0-9][^\s)]*)", rest_without_keyset):
+            dt = parse_soql_datetime(ts)
+            if operator == "<":
+                end = min(end, self.first_index_after(dt, inclusive=True))
+            else:
+                start = max(start, self.first_index_after(dt, inclusive=operator == ">="))
+        indexes = range(start, max(start, end))
+        in_clause = re.search(r"(\w+)\s+IN\s*\(([^)]*)\)", rest, re.IGNORECASE)
+        if in_clause:
+            values = [v.strip().strip("'") for v in in_clause.group(2).split(",")]
+            if in_clause.group(1) == "Id":
+                indexes = [int(v[3:]) for v in values if v[3:].isdigit() and int(v[3:]) < self.rows]
+            else:
+                indexes = [int(v[4:]) for v in values if v[4:].isdigit() and int(v[4:]) < self.rows]
+        limit = re.search(r"\blimit\s+(\d+)", rest, re.IGNORECASE)
+        if limit:
+            indexes = indexes[:int(limit.group(1))]
+        return [f.strip() for f in select.split(",")], indexes, sobject
+
+    def query(self, soql):
+        field_names, indexes, sobject = self.run_query(soql)
+        if field_names == ["count()"]:
+            return {"totalSize": len(indexes), "done": True, "records": []}
+        if field_names[0].lower().startswith("min("):
+            record = {"attributes": {"type": "AggregateResult"}, "minValue": None, "maxValue": None}
+            if len(indexes):
+                record["minValue"] = format_datetime(self.modstamp(indexes[0]))
+                record["maxValue"] = format_datetime(self.modstamp(indexes[-1]))
+            return {"totalSize": 1, "done": True, "records": [record]}
+        query_id = uuid.uuid4().hex
+        with self._lock:
+            self._queries[query_id] = (field_names, indexes, sobject)
+        return self.query_page(query_id, 0)
+
+    def query_page(self, query_id, offset):
+        field_names, indexes, sobject = self._queries[query_id]
+        page = indexes[offset:offset + self.page_size]
+        result = {"totalSize": len(indexes), "done": offset + self.page_size >= len(indexes),
+            "records": [self.record(i, field_names, sobject) for i in page]}
+        if result["done"]:
+            with self._lock:
+                self._queries.pop(query_id, None)
+        else:
+            result["nextRecordsUrl"] = f"/services/data/v60.0/query/{query_id}-{offset + self.page_size}"
+        return result
+
+    def csv_page(self, job_id, offset, max_records):
+        field_names, indexes, _ = self._jobs[job_id]["query"]
+        page = indexes[offset:offset + max_records]
+        output = io.StringIO()
+        writer = csv.writer(output, lineterminator="\n")
+        writer.writerow(field_names)
+        for i in page:
+            values = []
+            for name in field_names:
+                value = self.field_value(i, name)
+                values.append("" if value is None else str(value).lower() if isinstance(value, bool) else value)
+            writer.writerow(values)
+        locator = str(offset + max_records) if offset + max_records < len(indexes) else "null"
+        return output.getvalue().encode("utf-8"), locator
+
+    # tooling
+
+    def valueset_metadata(self, path):
+        values = [{"valueName": f"value{i}", "label": f"Value {i}", "default": False, "isActive": True,
+            "description": None, "color": None} for i in range(self.valueset_size)]
+        if "/GlobalValueSet/" in path:
+            return {"Id": path.split("/")[-1], "Metadata": {"customValue": values, "masterLabel": "GVS", "sorted": False}}
+        return {"Id": path.split("/")[-1], "Metadata": {"valueSet": {"valueSetDefinition": {"value": values,
+            "sorted": False}, "valueSettings": [], "restricted": True}, "label": "Picklist", "type": "Picklist"}}
+
+    # request handling
+
+    def handle(self, method, path, query, body):
+        '''returns (status, headers, body) of a call'''
+        call = (method, re.sub(r"\w*\d{6,}\w*", "*", path))
+        with self._lock:
+            self.api_usage += 1
+            self.calls[call] = self.calls.get(call, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+        status, headers, content = self._route(method, path, query, body)
+        headers = dict(headers)
+        headers["Sforce-Limit-Info"] = f"api-usage={self.api_usage}/{self.api_limit}"
+        if not isinstance(content, (bytes, bytearray)):
+            content = b"" if content is None else json.dumps(content).encode("utf-8")
+            headers.setdefault("Content-Type", "application/json")
+        return status, headers, content
+
+    def _route(self, method, path, query, body):
+        if path == "/services/oauth2/token":
+            return 200, {}, {"access_token": "fake-session", "instance_url": "https://fake.my.salesforce.com",
+                "id": "https://fake.my.salesforce.com/id/00D/005", "token_type": "Bearer"}
+        m = re.match(r"/services/async/[\d.]+/(.*)$", path)
+        if m:
+            return self._bulk1(method, m.group(1), body)
+        m = re.match(r"/services/data/v[\d.]+/(.*)$", path)
+        if not m:
+            return 404, {}, [{"errorCode": "NOT_FOUND", "message": path}]
+        resource = m.group(1).rstrip("/")
+        if resource.startswith("tooling/"):
+            return self._tooling(method, resource[len("tooling/"):], body)
+        if resource in ("query", "queryAll"):
+            return 200, {}, self.query(query["q"][0])
+        m = re.match(r"query(?:All)?/(\w+)-(\d+)$", resource)
+        if m:
+            return 200, {}, self.query_page(m.group(1), int(m.group(2)))
+        if resource.startswith("jobs/"):
+            return self._bulk2(method, resource[len("jobs/"):], query, body)
+        if resource == "composite":
+            return 200, {}, self._composite(body)
+        if resource.startswith("composite/sobjects"):
+            return self._collections(method, query, body)
+        m = re.match(r"sobjects/(\w+)/describe$", resource)
+        if m:
+            return 200, {"Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"}, {"name": m.group(1), "fields": self.fields}
+        m = re.match(r"sobjects/(\w+)(?:/(\w+))?(?:/([^/]+))?$", resource)
+        if m:
+            return self._sobject(method, m.group(1), m.group(2), m.group(3), body)
+        return 404, {}, [{"errorCode": "NOT_FOUND", "message": resource}]
+
+    def _sobject(self, method, sobject, key, value, body):
+        if method == "POST" and not key:
+            return 201, {}, {"id": self.record_id(int(uuid.uuid4().int % 10 ** 12)), "success": True, "errors": []}
+        if method == "GET" and key and not value:
+            index = int(key[3:]) if key[3:].isdigit() else 0
+            return 200, {}, self.record(index, [f["name"] for f in self.fields], sobject)
+        if method in ("PATCH", "DELETE"):
+            return 204, {}, None
+        return 404, {}, [{"errorCode": "NOT_FOUND", "message": sobject}]
+
+    def _collections(self, method, query, body):
+        if method == "DELETE":
+            ids = query["ids"][0].split(",")
+            return 200, {}, [{"id": i, "success": True, "errors": []} for i in ids]
+        records = json.loads(body)["records"]
+        return 200, {}, [{"id": r.get("Id") or self.record_id(n), "success": True, "errors": [], "created": False}
+            for n, r in enumerate(records)]
+
+    def _composite(self, body):
+        results = []
+        for subrequest in json.loads(body)["compositeRequest"]:
+            url = urlparser.urlsplit(subrequest["url"])
+            sub_body = json.dumps(subrequest["body"]).encode("utf-8") if "body" in subrequest else b""
+            status, headers, content = self._route(subrequest["method"], url.path, urlparser.parse_qs(url.query), sub_body)
+            if not isinstance(content, (bytes, bytearray)):
+                content = None if content is None else json.loads(json.dumps(content))
+            results.append({"body": content, "httpHeaders": {}, "httpStatusCode": status,
+                "referenceId": subrequest["referenceId"]})
+        return {"compositeResponse": results}
+
+    def _tooling(self, method, resource, body):
+        if resource == "composite":
+            return 200, {}, self._composite(body)
+        m = re.match(r"sobjects/(GlobalValueSet|CustomField)/(\w+)$", resource)
+        if m:
+            if method == "GET":
+                return 200, {}, self.valueset_metadata("/" + resource)
+            return 204, {}, None
+        if resource.startswith("query"):
+            return 200, {}, {"totalSize": 0, "done": True, "records": []}
+        return 404, {}, [{"errorCode": "NOT_FOUND", "message": resource}]
+
+    def _bulk2(self, method, resource, query, body):
+        m = re.match(r"(query|ingest)(?:/(\w+))?(?:/(\w+))?$", resource)
+        kind, job_id, action = m.group(1), m.group(2), m.group(3)
+        if method == "POST" and not job_id:
+            job_data = json.loads(body)
+            job_id = uuid.uuid4().hex[:18]
+            job = {"id": job_id, "state": "UploadComplete" if kind == "query" else "Open",
+                "object": job_data.get("object"), "operation": job_data["operation"]}
+            if kind == "query":
+                job["query"] = self.run_query(job_data["query"])
+            with self._lock:
+                self._jobs[job_id] = job
+            return 200, {}, {k: v for k, v in job.items() if k != "query"}
+        job = self._jobs[job_id]
+        if action == "results":
+            offset = int(query.get("locator", ["0"])[0])
+            content, locator = self.csv_page(job_id, offset, int(query.get("maxRecords", ["50000"])[0]))
+            return 200, {"Content-Type": "text/csv", "Sforce-Locator": locator}, content
+        if action == "batches":
+            job["numberRecordsProcessed"] = max(0, body.count(b"\n") - 1)
+            return 201, {}, None
+        if action == "failedResults":
+            return 200, {"Content-Type": "text/csv"}, b'"sf__Id","sf__Error"\n'
+        if method == "PATCH":
+            job["state"] = "UploadComplete"
+        elif method == "GET":
+            job["state"] = "JobComplete"
+        return 200, {}, {"id": job_id, "state": job["state"], "numberRecordsFailed": 0,
+            "numberRecordsProcessed": job.get("numberRecordsProcessed", 0)}
+
+    def _bulk1(self, method, resource, body):
+        parts = resource.strip("/").split("/")
+        if parts == ["job"]:
+            job_id = "750" + uuid.uuid4().hex[:15]
+            with self._lock:
+                self._jobs[job_id] = {"id": job_id, "batches": {}}
+            return 201, {}, {"id": job_id, "state": "Open"}
+        job = self._jobs[parts[1]]
+        if len(parts) == 2:
+            return 200, {}, {"id": job["id"], "state": "Closed"}
+        if len(parts) == 3 and method == "POST":
+            batch_id = "751" + uuid.uuid4().hex[:15]
+            records = json.loads(body)
+            job["batches"][batch_id] = [r.get("Id") for r in records]
+            return 201, {}, {"id": batch_id, "jobId": job["id"], "state": "Queued"}
+        batch_ids = job["batches"][parts[3]]
+        if len(parts) == 4:
+            return 200, {}, {"id": parts[3], "jobId": job["id"], "state": "Completed"}
+        return 200, {}, [{"success": True, "created": False, "id": sf_id or self.record_id(n), "errors": []}
+            for n, sf_id in enumerate(batch_ids)]
+
+    # server
+
+    def start(self, port=0):
+        '''starts serving on localhost in a daemon thread, returns the base url'''
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body are written separately, which Nagle's algorithm would delay on keep-alive connections
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _read_body(self):
+                if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                    chunks = []
+                    while True:
+                        size = int(self.rfile.readline().strip().split(b";")[0], 16)
+                        if size == 0:
+                            self.rfile.readline()
+                            return b"".join(chunks)
+                        chunks.append(self.rfile.read(size))
+                        self.rfile.readline()
+                return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+            def _handle(self):
+                url = urlparser.urlsplit(self.path)
+                status, headers, content = fake.handle(self.command, url.path, urlparser.parse_qs(url.query),
+                    self._read_body())
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _handle
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
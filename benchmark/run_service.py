@@ -0,0 +1,41 @@
+'''runs the service with waitress, or uvicorn when WEBFRAMEWORK=ASGI, against the fake Salesforce at FAKE_SALESFORCE_URL. The Salesforce client
+only speaks https, so its calls are sent to the plain http fake server by a transport adapter.
+Started by benchmark.py, configured with the same env vars as the service.'''
+import logging
+import os
+import sys
+from urllib import parse as urlparser
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "service"))
+import service
+
+
+class FakeSalesforceAdapter(requests.adapters.HTTPAdapter):
+    '''sends every https call to the fake server, keeping the path and query'''
+    def __init__(self, target_url, **kwargs):
+        self.target_url = target_url.rstrip("/")
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        url = urlparser.urlsplit(request.url)
+        request.url = self.target_url + url.path + (f"?{url.query}" if url.query else "")
+        return super().send(request, **kwargs)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.getLevelName(os.environ.get("LOG_LEVEL", "WARNING")),
+        format='%(name)s - %(levelname)s - %(message)s')
+    service.logger = logging.getLogger("salesforce")
+    service.http_session.mount("https://", FakeSalesforceAdapter(os.environ["FAKE_SALESFORCE_URL"],
+        pool_maxsize=max(service.WAITRESS_THREADS, service.ASGI_THREADS, service.API_MAX_CONCURRENCY)))
+
+    port = int(os.environ.get("PORT", 5000))
+    if os.environ.get("WEBFRAMEWORK") == "ASGI":
+        import uvicorn
+        uvicorn.run(service.AsgiApp(service.app, threads=service.ASGI_THREADS), host="127.0.0.1", port=port,
+            lifespan="on", log_level="warning", access_log=False)
+    else:
+        from waitress import serve
+        serve(service.app, host="127.0.0.1", port=port, threads=service.WAITRESS_THREADS)
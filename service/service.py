@@ -1,14 +1,36 @@
-from functools import wraps
-from flask import Flask, request, Response, abort
+from functools import wraps, lru_cache
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, request, Response, abort, g
+from werkzeug.exceptions import HTTPException
 from datetime import datetime, timedelta, timezone
 from dateutil.parser import parse
 from urllib import parse as urlparser 
+from collections import OrderedDict
 import os
+import io
+import copy
+import hashlib
+import random
+import codecs
+import itertools
+import csv
+import time
+import re
+import queue
+import sqlite3
+import threading
+import zlib
+import asyncio
 
 import json
-from simple_salesforce import Salesforce, SalesforceError, SalesforceResourceNotFound, SalesforceAuthenticationFailed
+from simple_salesforce import Salesforce, SalesforceError, SalesforceGeneralError, SalesforceResourceNotFound, SalesforceAuthenticationFailed
 import requests
 import logging
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 app = Flask(__name__)
 
@@ -16,12 +38,80 @@ SF_OBJECTS_CONFIG = json.loads(os.environ.get("SF_OBJECTS_CONFIG","{}"))
 VALUESET_LIST = json.loads(os.environ.get("VALUESET_LIST","{}"))
 API_VERSION = os.environ.get("API_VERSION","60.0")
 DEFAULT_BULK_SWITCH_THRESHOLD = int(os.environ.get("DEFAULT_BULK_SWITCH_THRESHOLD", 0))
-salesforce_service_refreshed_at_interval = int(os.environ.get("SALESFORCE_SERVICE_REFRESHED_AT_INTERVAL", 45))
+DEFAULT_BULK_QUERY_THRESHOLD = int(os.environ.get("DEFAULT_BULK_QUERY_THRESHOLD", 0))
+BULK_QUERY_PAGE_SIZE = int(os.environ.get("BULK_QUERY_PAGE_SIZE", 50000))
+BULK_JOB_POLL_INTERVAL = float(os.environ.get("BULK_JOB_POLL_INTERVAL", 2))
+REST_COLLECTIONS_MAX_WORKERS = int(os.environ.get("REST_COLLECTIONS_MAX_WORKERS", 4))
+EXTERNAL_ID_CACHE_SIZE = int(os.environ.get("EXTERNAL_ID_CACHE_SIZE", 0))
+EXTERNAL_ID_INDEX_PATH = os.environ.get("EXTERNAL_ID_INDEX_PATH")
+RECEIVER_CHUNK_SIZE = int(os.environ.get("RECEIVER_CHUNK_SIZE", 10000))
+WRITE_DEDUP_CACHE_SIZE = int(os.environ.get("WRITE_DEDUP_CACHE_SIZE", 0))
+WRITE_DEDUP_PATH = os.environ.get("WRITE_DEDUP_PATH")
+COLLECTIONS_BATCH_SIZE = 200
+ALREADY_DELETED_ERROR_CODES = ["ENTITY_IS_DELETED", "INVALID_CROSS_REFERENCE_KEY", "NOT_FOUND"]
+SOQL_IN_CLAUSE_MAX_LENGTH = 8000
+# describe types whose values are not quoted in SOQL
+SOQL_NUMBER_FIELD_TYPES = ["int", "long", "double", "currency", "percent"]
+SOQL_NUMBER_PATTERN = re.compile(r"^-?\d+(\.\d+)?$")
+DESCRIBE_CACHE_TTL = int(os.environ.get("DESCRIBE_CACHE_TTL", 3600))
+DESCRIBE_CACHE_PATH = os.environ.get("DESCRIBE_CACHE_PATH")
+WAITRESS_THREADS = int(os.environ.get("WAITRESS_THREADS", 4))
+ASGI_THREADS = int(os.environ.get("ASGI_THREADS", 8))
+API_MAX_CONCURRENCY = int(os.environ.get("API_MAX_CONCURRENCY", 25))
+API_MIN_CONCURRENCY = int(os.environ.get("API_MIN_CONCURRENCY", 1))
+API_RATE_LIMITS = json.loads(os.environ.get("API_RATE_LIMITS", "{}"))
+API_USAGE_SOFT_LIMIT = float(os.environ.get("API_USAGE_SOFT_LIMIT", 0.9))
+API_RETRY_MAX = int(os.environ.get("API_RETRY_MAX", 3))
+API_RETRY_BACKOFF = float(os.environ.get("API_RETRY_BACKOFF", 1))
+PROFILE_REQUESTS = os.environ.get("PROFILE_REQUESTS", "false").lower() == "true"
+VALUESET_MAX_WORKERS = int(os.environ.get("VALUESET_MAX_WORKERS", 4))
+VALUESET_CACHE_TTL = int(os.environ.get("VALUESET_CACHE_TTL", 300))
+TOOLING_COMPOSITE_BATCH_SIZE = 25
+SINCE_CURSOR = os.environ.get("SINCE_CURSOR", "false").lower() == "true"
+KEYSET_PAGE_SIZE = int(os.environ.get("KEYSET_PAGE_SIZE", 10000))
+PARALLEL_QUERY_BUFFER_ROWS = int(os.environ.get("PARALLEL_QUERY_BUFFER_ROWS", 10000))
+salesforce_service_refreshed_at_interval = int(os.environ.get("SALESFORCE_SERVICE_REFRESHED_AT_INTERVAL", 0))
 salesforce_service = None
 salesforce_service_refreshed_at = None
+salesforce_service_lock = threading.Lock()
+
+SF_DATETIME_PATTERN = re.compile(r"(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})(?:\.(\d{1,6}))?(Z|[+-]\d{2}:?\d{2})?$")
 
 def datetime_format(dt):
-    return '%04d' % dt.year + dt.strftime("-%m-%dT%H:%M:%SZ")
+    return '%04d-%02d-%02dT%02d:%02d:%02dZ' % (dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second)
+
+def parse_datetime(dt_str):
+    '''parses the ISO-8601 formats returned by Salesforce(fex '2024-01-01T12:00:00.000+0000') without dateutil,
+        any other format is handed over to dateutil'''
+    m = SF_DATETIME_PATTERN.match(dt_str)
+    if not m:
+        return parse(dt_str)
+    year, month, day, hour, minute, second, fraction, offset = m.groups()
+    tzinfo = None
+    if offset == "Z":
+        tzinfo = timezone.utc
+    elif offset:
+        offset_minutes = int(offset[1:3]) * 60 + int(offset[-2:])
+        tzinfo = timezone(timedelta(minutes=-offset_minutes if offset[0] == "-" else offset_minutes)) if offset_minutes else timezone.utc
+    try:
+        return datetime(int(year), int(month), int(day), int(hour), int(minute), int(second),
+                        int(fraction.ljust(6, "0")) if fraction else 0, tzinfo=tzinfo)
+    except ValueError:
+        return parse(dt_str)
+
+SINCE_CURSOR_PATTERN = re.compile(r"^(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d{3}Z)_([A-Za-z0-9]{15,18})$")
+
+def to_since_cursor(updated_value, sf_id):
+    '''returns the cursor token of a row, '<updated in UTC with milliseconds>_<Id>'. Unlike the '_updated' datetime
+        it keeps the milliseconds and breaks ties on Id, so a query can continue right after the row.'''
+    dt = parse_datetime(updated_value).astimezone(timezone.utc)
+    return '%04d-%02d-%02dT%02d:%02d:%02d.%03dZ_%s' % (dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second,
+        dt.microsecond // 1000, sf_id)
+
+def parse_since_cursor(since):
+    '''returns the (updated, Id) pair of a cursor token, None if since is a plain datetime'''
+    m = SINCE_CURSOR_PATTERN.match(since)
+    return m.groups() if m else None
 
 def to_transit_datetime(dt):
     return "~t" + datetime_format(dt)
@@ -29,6 +119,267 @@ def to_transit_datetime(dt):
 def to_nontransit_datetime(dt_str):
     return dt_str if dt_str[0:2] != "~t" else dt_str[2:]
 
+@lru_cache(maxsize=8192)
+def _convert_datetime_value(value):
+    if isinstance(value, int):
+        return to_transit_datetime(datetime.fromtimestamp(value/1000))
+    elif isinstance(value, str):
+        return to_transit_datetime(parse_datetime(value))
+    return value
+
+# maps describe field types to the conversion applied on rows read from Salesforce
+FIELD_TYPE_CONVERTERS = {
+    "datetime": _convert_datetime_value
+}
+
+# maps describe field types to the cast applied on Bulk API CSV values, other types are kept as string
+BULK_CSV_FIELD_CASTS = {
+    "boolean": lambda v: v == "true",
+    "int": int,
+    "double": float,
+    "currency": float,
+    "percent": float
+}
+
+# field types that Bulk API queries cannot select
+BULK_QUERY_UNSUPPORTED_FIELD_TYPES = ["address", "location", "base64"]
+
+# field types and textarea length that 'skip_large_fields' leaves out of GET queries
+LARGE_FIELD_TYPES = ["address", "location", "base64"]
+LARGE_TEXTAREA_LENGTH = 4096
+
+# fields that are always selected since sesamify needs them
+REQUIRED_FIELDS = ["Id", "SystemModstamp", "CreatedDate", "IsDeleted"]
+
+class BulkJobFailed(Exception):
+    '''raised when a bulk job ends in another state than JobComplete'''
+
+def _wait_for_bulk2_job(sf, job_url, job):
+    with timed("bulk_job_wait"):
+        while job["state"] not in ["JobComplete", "Failed", "Aborted"]:
+            time.sleep(BULK_JOB_POLL_INTERVAL)
+            job = sf._call_salesforce("GET", job_url, name="bulk2").json()
+    if job["state"] != "JobComplete":
+        raise BulkJobFailed(f"bulk job {job['id']} ended with state {job['state']}: {job.get('errorMessage')}")
+    return job
+
+def _iter_csv_response(response):
+    '''yields the rows of a streamed CSV response as dicts while it is downloaded'''
+    try:
+        response.raw.decode_content = True
+        response.raw.auto_close = False
+        yield from csv.DictReader(io.TextIOWrapper(response.raw, encoding="utf-8", newline=""))
+    finally:
+        response.close()
+
+def bulk2_query_iter(sf, query, include_deleted=False):
+    '''runs the query as a Bulk API 2.0 query job and yields the result rows as dicts of strings.
+        Result pages are parsed while they are downloaded, so a page is never held in memory as a whole.
+        If the iterator is closed or fails before the last page, the job is aborted, or deleted if it has completed.'''
+    job = sf._call_salesforce("POST", f"{sf.bulk2_url}query", name="bulk2 query",
+        data=json.dumps({"operation": "queryAll" if include_deleted else "query", "query": query})).json()
+    job_url = f"{sf.bulk2_url}query/{job['id']}"
+    logger.debug(f"created bulk query job {job['id']}")
+    state = "running"
+    try:
+        try:
+            _wait_for_bulk2_job(sf, job_url, job)
+        except BulkJobFailed:
+            state = "ended"
+            raise
+        state = "completed"
+
+        locator = None
+        while True:
+            params = {"maxRecords": BULK_QUERY_PAGE_SIZE}
+            if locator:
+                params["locator"] = locator
+            response = sf._call_salesforce("GET", f"{job_url}/results", name="bulk2 query",
+                params=params, headers={"Accept": "text/csv"}, stream=True)
+            yield from _iter_csv_response(response)
+            locator = response.headers.get("Sforce-Locator")
+            if not locator or locator == "null":
+                state = "ended"
+                return
+    finally:
+        if state != "ended":
+            _close_bulk2_query_job(sf, job_url, state == "completed")
+
+def _close_bulk2_query_job(sf, job_url, completed):
+    '''aborts a query job that is still running, or deletes a completed one together with its results'''
+    try:
+        if completed:
+            sf._call_salesforce("DELETE", job_url, name="bulk2 query")
+        else:
+            sf._call_salesforce("PATCH", job_url, name="bulk2 query", data=json.dumps({"state": "Aborted"}))
+        logger.debug(f"{'deleted' if completed else 'aborted'} bulk query job {job_url} that was not read to the end")
+    except Exception as err:
+        logger.warning(f"could not {'delete' if completed else 'abort'} bulk query job {job_url}: {err}")
+
+def _to_csv_value(value):
+    if value is None:
+        return "#N/A"
+    elif isinstance(value, bool):
+        return "true" if value else "false"
+    elif isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+def _flatten_record(record):
+    '''flattens relationship references like {"Account": {"Ext__c": "x"}} to {"Account.Ext__c": "x"}'''
+    flat = OrderedDict()
+    for k, v in record.items():
+        if k == "attributes":
+            continue
+        elif isinstance(v, dict):
+            for nested_k, nested_v in v.items():
+                if nested_k != "attributes":
+                    flat[f"{k}.{nested_k}"] = nested_v
+        else:
+            flat[k] = v
+    return flat
+
+def _iter_csv_chunks(columns, rows, chunk_size=1048576):
+    '''yields the rows as utf-8 encoded CSV in chunks of about chunk_size bytes'''
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([_to_csv_value(row[c]) if c in row else "" for c in columns])
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+def bulk2_ingest(sf, datatype, operation, records, external_id_field=None):
+    '''runs one Bulk API 2.0 ingest job, the records are uploaded as CSV.
+        Returns the failed records as dicts of the uploaded columns plus sf__Id and sf__Error.'''
+    job_data = {"object": datatype, "operation": operation, "contentType": "CSV", "lineEnding": "LF"}
+    if external_id_field:
+        job_data["externalIdFieldName"] = external_id_field
+    job = sf._call_salesforce("POST", f"{sf.bulk2_url}ingest", name="bulk2 ingest", data=json.dumps(job_data)).json()
+    job_url = f"{sf.bulk2_url}ingest/{job['id']}"
+    logger.debug(f"created bulk ingest job {job['id']} to {operation} {len(records)} {datatype}")
+
+    columns = list(OrderedDict.fromkeys(c for r in records for c in _flatten_record(r)))
+    # the body is passed as a factory so that a retried upload streams the CSV again
+    sf._call_salesforce("PUT", f"{job_url}/batches", name="bulk2 ingest",
+        data=lambda: _iter_csv_chunks(columns, (_flatten_record(r) for r in records)), headers={"Content-Type": "text/csv"})
+    sf._call_salesforce("PATCH", job_url, name="bulk2 ingest", data=json.dumps({"state": "UploadComplete"}))
+    job = _wait_for_bulk2_job(sf, job_url, job)
+
+    if not int(job.get("numberRecordsFailed", 0)):
+        return []
+    response = sf._call_salesforce("GET", f"{job_url}/failedResults/", name="bulk2 ingest",
+        headers={"Accept": "text/csv"}, stream=True)
+    return list(_iter_csv_response(response))
+
+class _ChunkFailure:
+    def __init__(self, err):
+        self.err = err
+
+_END_OF_CHUNK = object()
+
+def iter_concurrently(iterator_factories, max_workers, ordered=True, buffer_size=2000):
+    '''consumes the iterators returned by iterator_factories on a bounded worker pool.
+        Items are yielded in the order of iterator_factories if ordered is set, otherwise as they arrive.
+        If ordered, each iterator can buffer at most buffer_size items ahead of the consumer and then waits until
+        the consumer reaches it, otherwise the iterators share one buffer of buffer_size items.'''
+    cancelled = threading.Event()
+    queues = [queue.Queue(maxsize=buffer_size) for _ in iterator_factories] if ordered else [queue.Queue(maxsize=buffer_size)]
+
+    def _put(q, item):
+        while not cancelled.is_set():
+            try:
+                q.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _worker(q, iterator_factory):
+        if cancelled.is_set():
+            return
+        try:
+            for item in iterator_factory():
+                if not _put(q, item):
+                    return
+            _put(q, _END_OF_CHUNK)
+        except Exception as err:
+            _put(q, _ChunkFailure(err))
+
+    def _drain(q, expected_ends):
+        while expected_ends > 0:
+            item = q.get()
+            if item is _END_OF_CHUNK:
+                expected_ends -= 1
+            elif isinstance(item, _ChunkFailure):
+                raise item.err
+            else:
+                yield item
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        for i, iterator_factory in enumerate(iterator_factories):
+            executor.submit(_worker, queues[i] if ordered else queues[0], iterator_factory)
+        if ordered:
+            for q in queues:
+                yield from _drain(q, 1)
+        else:
+            yield from _drain(queues[0], len(iterator_factories))
+    finally:
+        cancelled.set()
+        executor.shutdown(wait=False)
+
+def soql_quote(value):
+    return "'" + str(value).replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+def encode_json(obj):
+    '''encodes obj to utf-8 JSON, with orjson if it is installed'''
+    if orjson:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass
+    return json.dumps(obj).encode("utf-8")
+
+def iter_json_array_chunks(encoded_items, chunk_size=65536):
+    '''joins the encoded JSON items into a JSON array that is yielded in chunks of about chunk_size bytes'''
+    buffer = [b"["]
+    buffered_size = 1
+    separator = b""
+    for item in encoded_items:
+        buffer.append(separator)
+        buffer.append(item)
+        buffered_size += len(separator) + len(item)
+        separator = b",\n"
+        if buffered_size >= chunk_size:
+            yield b"".join(buffer)
+            buffer = []
+            buffered_size = 0
+    buffer.append(b"]")
+    yield b"".join(buffer)
+
+def gzip_chunks(chunks, compresslevel=6):
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def to_select_clause(field_names):
+    '''joins the field names into a SOQL select list. Repeated names are left out since SOQL rejects
+        duplicate fields, and field names are case-insensitive in SOQL.'''
+    unique_names = OrderedDict()
+    for name in field_names:
+        unique_names.setdefault(name.strip().lower(), name.strip())
+    return ",".join(unique_names.values())
+
+def to_where_clause(conditions):
+    return "where {}".format(" AND ".join(conditions)) if conditions else ""
+
 def get_var(var, scope=None, is_required=False):
     envvar = None
     if (scope is None or scope=="REQUEST") and var in request.args:
@@ -39,20 +390,420 @@ def get_var(var, scope=None, is_required=False):
         abort(400, "cannot read required '%s' from request params or envvars" % (var.upper()))
     return envvar
 
+DEFAULT_HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+class Metrics:
+    '''thread-safe counters, gauges and histograms rendered in the Prometheus text format'''
+    def __init__(self, buckets=DEFAULT_HISTOGRAM_BUCKETS):
+        self.buckets = buckets
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def _key(self, name, labels):
+        return (name, tuple(sorted((labels or {}).items())))
+
+    def inc(self, name, labels=None, value=1):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name, labels=None, value=0):
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    def observe(self, name, labels=None, value=0):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bucket in enumerate(self.buckets):
+                if value <= bucket:
+                    histogram[0][i] += 1
+            histogram[1] += 1
+            histogram[2] += value
+
+    def render(self):
+        def _labels(labels, extra=()):
+            labels = tuple(labels) + tuple(extra)
+            if not labels:
+                return ""
+            return "{" + ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels) + "}"
+
+        lines = []
+        with self._lock:
+            for metric_type, values in (("counter", self._counters), ("gauge", self._gauges)):
+                for name in sorted(set(name for name, _ in values)):
+                    lines.append(f"# TYPE {name} {metric_type}")
+                    lines += [f"{name}{_labels(labels)} {value}" for (n, labels), value in sorted(values.items()) if n == name]
+            for name in sorted(set(name for name, _ in self._histograms)):
+                lines.append(f"# TYPE {name} histogram")
+                for (n, labels), (bucket_counts, count, total) in sorted(self._histograms.items()):
+                    if n != name:
+                        continue
+                    for bucket, bucket_count in zip(self.buckets, bucket_counts):
+                        lines.append(f"{name}_bucket{_labels(labels, [('le', bucket)])} {bucket_count}")
+                    lines.append(f"{name}_bucket{_labels(labels, [('le', '+Inf')])} {count}")
+                    lines.append(f"{name}_sum{_labels(labels)} {total}")
+                    lines.append(f"{name}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+class RequestProfile:
+    '''accumulates the time spent per stage while serving one request'''
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.stages = OrderedDict()
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0) + seconds
+
+    def to_server_timing(self):
+        timings = [("total", time.perf_counter() - self.started_at)] + list(self.stages.items())
+        return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings)
+
+_profile_local = threading.local()
+
+def get_profile():
+    '''returns the profile of the request served by the current thread, None if the request is not profiled'''
+    return getattr(_profile_local, "profile", None)
+
+def timed_iter(iterable, profile, stage):
+    '''yields the items of iterable, adding the time spent waiting for each item to the stage of the profile'''
+    iterator = iter(iterable)
+    while True:
+        started_at = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            profile.add(stage, time.perf_counter() - started_at)
+        yield item
+
+@contextmanager
+def timed(stage):
+    '''observes the duration of the block in the stage histogram and adds it to the profile of the current request'''
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started_at
+        metrics.observe("salesforce_stage_duration_seconds", {"stage": stage}, elapsed)
+        profile = get_profile()
+        if profile:
+            profile.add(stage, elapsed)
+
+class LRUCache:
+    '''thread-safe dict that keeps at most maxsize of the most recently used items'''
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                return default
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._items.pop(key, default)
+
+    def pop_where(self, predicate):
+        '''removes the items for which predicate(key, value) is true'''
+        with self._lock:
+            for key in [k for k, v in self._items.items() if predicate(k, v)]:
+                del self._items[key]
+
+class ExternalIdIndex:
+    '''maps (sobject, external id field, value) to Salesforce Id. Lookups go through an in-memory LRU cache,
+        and if path is given the mappings are also stored in a SQLite database so that they survive restarts.'''
+    def __init__(self, cache_size, path=None):
+        self._cache = LRUCache(cache_size)
+        self._db = None
+        self._lock = threading.Lock()
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("create table if not exists external_id_index "
+                "(sobject text, key_field text, key_value text, id text, primary key (sobject, key_field, key_value))")
+            self._db.commit()
+
+    def get(self, datatype, key_field, value):
+        key = (datatype, key_field, str(value))
+        sf_id = self._cache.get(key)
+        if sf_id is None and self._db:
+            with self._lock:
+                row = self._db.execute("select id from external_id_index where sobject=? and key_field=? and key_value=?", key).fetchone()
+            if row:
+                sf_id = row[0]
+                self._cache.put(key, sf_id)
+        return sf_id
+
+    def put_many(self, datatype, key_field, values_and_ids):
+        values_and_ids = [(str(value), sf_id) for value, sf_id in values_and_ids if value and sf_id]
+        for value, sf_id in values_and_ids:
+            self._cache.put((datatype, key_field, value), sf_id)
+        if self._db and values_and_ids:
+            with self._lock:
+                self._db.executemany("insert or replace into external_id_index values (?, ?, ?, ?)",
+                    [(datatype, key_field, value, sf_id) for value, sf_id in values_and_ids])
+                self._db.commit()
+
+    def delete_values(self, datatype, key_field, values):
+        values = [str(value) for value in values if value]
+        for value in values:
+            self._cache.pop((datatype, key_field, value))
+        if self._db and values:
+            with self._lock:
+                self._db.executemany("delete from external_id_index where sobject=? and key_field=? and key_value=?",
+                    [(datatype, key_field, value) for value in values])
+                self._db.commit()
+
+    def delete_ids(self, datatype, sf_ids):
+        '''removes the mappings to the given Ids, fex of deleted records'''
+        sf_ids = set(sf_id for sf_id in sf_ids if sf_id)
+        if not sf_ids:
+            return
+        self._cache.pop_where(lambda key, sf_id: key[0] == datatype and sf_id in sf_ids)
+        if self._db:
+            with self._lock:
+                self._db.executemany("delete from external_id_index where sobject=? and id=?",
+                    [(datatype, sf_id) for sf_id in sf_ids])
+                self._db.commit()
+
+external_id_index = ExternalIdIndex(EXTERNAL_ID_CACHE_SIZE or 10000, EXTERNAL_ID_INDEX_PATH) \
+    if EXTERNAL_ID_CACHE_SIZE > 0 or EXTERNAL_ID_INDEX_PATH else None
+
+def index_external_ids(datatype, rows):
+    '''stores the external id to Id mappings of the given rows for the 'ordered_key_fields' of the sobject,
+        and removes the mappings of the deleted rows'''
+    if external_id_index:
+        external_id_index.delete_ids(datatype, [r.get("Id") for r in rows if r.get("IsDeleted")])
+        for key_field in SF_OBJECTS_CONFIG.get(datatype, {}).get("ordered_key_fields", []):
+            external_id_index.put_many(datatype, key_field,
+                [(r.get(key_field), r.get("Id")) for r in rows if not r.get("IsDeleted")])
+
+def _to_soql_number(value):
+    '''returns the value as a SOQL number literal, None if it is not a number'''
+    value = str(value).strip()
+    return value if SOQL_NUMBER_PATTERN.match(value) else None
+
+def _get_value_key(field):
+    '''returns the function that maps a value of the external id field to what it is matched on. Numbers are matched
+        on their value, and text is case-insensitive unless the field is case-sensitive, like Salesforce does.'''
+    if field.get("type") in SOQL_NUMBER_FIELD_TYPES:
+        def _number_key(value):
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                return str(value)
+        return _number_key
+    if field.get("caseSensitive"):
+        return str
+    return lambda value: str(value).lower()
+
+def _query_ids(sf, datatype, key_field, sf_ids, values, quote=soql_quote):
+    '''selects Id and key_field of the records with the given Ids or key_field values via SOQL 'IN' queries whose
+        value lists are kept below SOQL_IN_CLAUSE_MAX_LENGTH. quote turns a key_field value into a SOQL literal,
+        values it returns None for are left out. Returns the rows and the number of queries.'''
+    chunks = []
+    chunk_length = SOQL_IN_CLAUSE_MAX_LENGTH
+    for field, value in [("Id", sf_id) for sf_id in sf_ids] + [(key_field, value) for value in values]:
+        quoted_value = soql_quote(value) if field == "Id" else quote(value)
+        if quoted_value is None:
+            continue
+        if chunk_length + len(quoted_value) + 1 > SOQL_IN_CLAUSE_MAX_LENGTH:
+            chunks.append(OrderedDict())
+            chunk_length = 0
+        chunks[-1].setdefault(field, []).append(quoted_value)
+        chunk_length += len(quoted_value) + 1
+    rows = []
+    for chunk in chunks:
+        where_clause = " or ".join(f"{field} IN ({','.join(quoted_values)})" for field, quoted_values in chunk.items())
+        rows += list(sf.query_all_iter(f"select Id, {key_field} from {datatype} where {where_clause}"))
+    return rows, len(chunks)
+
+def resolve_ids(sf, datatype, key_field, values, use_cache=True):
+    '''looks up the Ids of the records with the given key_field values. Ids from the external id index are checked
+        in the same queries, and the mappings that no longer hold are evicted and looked up again.
+        Values are matched like Salesforce matches external ids, see _get_value_key.
+        Values without a record are left out of the returned dict.'''
+    data_access_layer.reload_fields_metadata(sf, datatype)
+    field = next((f for f in data_access_layer._sobject_fields.get(datatype, []) if f["name"].lower() == key_field.lower()), {})
+    value_key = _get_value_key(field)
+    quote = _to_soql_number if field.get("type") in SOQL_NUMBER_FIELD_TYPES else soql_quote
+    cached_ids = {}
+    missing = []
+    for value in values:
+        cached_id = external_id_index.get(datatype, key_field, value) if external_id_index and use_cache else None
+        if cached_id:
+            cached_ids[value] = cached_id
+        else:
+            missing.append(value)
+    if external_id_index and use_cache:
+        metrics.inc("salesforce_cache_requests_total", {"cache": "external_id", "result": "hit"}, len(cached_ids))
+        metrics.inc("salesforce_cache_requests_total", {"cache": "external_id", "result": "miss"}, len(missing))
+
+    rows, query_count = _query_ids(sf, datatype, key_field, list(cached_ids.values()), missing, quote)
+    values_per_id = {row["Id"]: value_key(row[key_field]) for row in rows if row[key_field] is not None}
+    stale = [value for value, cached_id in cached_ids.items() if values_per_id.get(cached_id) != value_key(value)]
+    if stale:
+        logger.debug(f"{len(stale)} cached {datatype}/{key_field} Ids are stale")
+        external_id_index.delete_values(datatype, key_field, stale)
+        stale_rows, stale_query_count = _query_ids(sf, datatype, key_field, [], stale, quote)
+        rows += stale_rows
+        query_count += stale_query_count
+
+    ids_per_key = {value_key(row[key_field]): row["Id"] for row in rows if row[key_field] is not None}
+    ids = {value: ids_per_key[value_key(value)] for value in values if value_key(value) in ids_per_key}
+    if external_id_index:
+        external_id_index.put_many(datatype, key_field, list(ids.items()))
+    logger.debug(f"resolved {len(ids)} of {len(values)} {datatype}/{key_field} values to Ids with {query_count} queries")
+    return ids
+
+def redelete_with_fresh_ids(sf, datatype, key_field, failed_deletes):
+    '''retries deletes by external id that failed, since their Id may have come from a stale external id index
+        entry. failed_deletes are (value, Id, errors). The values are looked up again in Salesforce, and the deletes of
+        the values that now belong to another record are retried. Values without a record are done.
+        Returns the (value, errors) of the deletes that still failed.'''
+    fresh_ids = resolve_ids(sf, datatype, key_field, [value for value, _, _ in failed_deletes], use_cache=False)
+    failures = []
+    retries = []
+    for value, sf_id, errors in failed_deletes:
+        fresh_id = fresh_ids.get(value)
+        if fresh_id == sf_id:
+            failures.append((value, errors))
+        elif fresh_id:
+            retries.append((value, fresh_id))
+    logger.debug(f"retrying {len(retries)} of {len(failed_deletes)} failed {datatype}/{key_field} deletes with fresh Ids")
+    for i in range(0, len(retries), COLLECTIONS_BATCH_SIZE):
+        batch = retries[i:i + COLLECTIONS_BATCH_SIZE]
+        results = _collection_request(sf, datatype, "delete", "Id", [sf_id for _, sf_id in batch])
+        failures += [(value, result.get("errors")) for (value, _), result in zip(batch, results) if not result.get("success")]
+    external_id_index.delete_ids(datatype, [sf_id for _, sf_id in retries])
+    return failures
+
+class WriteDedupCache:
+    '''maps (sobject, object key) to the content hash of the last successfully written payload. Lookups go through
+        an in-memory LRU cache, and if path is given the hashes are also stored in a SQLite database.'''
+    def __init__(self, cache_size, path=None):
+        self._cache = LRUCache(cache_size)
+        self._db = None
+        self._lock = threading.Lock()
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("create table if not exists write_dedup "
+                "(sobject text, object_key text, content_hash text, primary key (sobject, object_key))")
+            self._db.commit()
+
+    def get(self, datatype, objectkey):
+        key = (datatype, objectkey)
+        content_hash = self._cache.get(key)
+        if content_hash is None and self._db:
+            with self._lock:
+                row = self._db.execute("select content_hash from write_dedup where sobject=? and object_key=?", key).fetchone()
+            if row:
+                content_hash = row[0]
+                self._cache.put(key, content_hash)
+        return content_hash
+
+    def put_many(self, datatype, keys_and_hashes):
+        for objectkey, content_hash in keys_and_hashes:
+            self._cache.put((datatype, objectkey), content_hash)
+        if self._db and keys_and_hashes:
+            with self._lock:
+                self._db.executemany("insert or replace into write_dedup values (?, ?, ?)",
+                    [(datatype, objectkey, content_hash) for objectkey, content_hash in keys_and_hashes])
+                self._db.commit()
+
+    def delete_many(self, datatype, objectkeys):
+        for objectkey in objectkeys:
+            self._cache.put((datatype, objectkey), None)
+        if self._db and objectkeys:
+            with self._lock:
+                self._db.executemany("delete from write_dedup where sobject=? and object_key=?",
+                    [(datatype, objectkey) for objectkey in objectkeys])
+                self._db.commit()
+
+write_dedup_cache = WriteDedupCache(WRITE_DEDUP_CACHE_SIZE or 100000, WRITE_DEDUP_PATH) \
+    if WRITE_DEDUP_CACHE_SIZE > 0 or WRITE_DEDUP_PATH else None
+
+def content_hash(entity):
+    return hashlib.blake2b(json.dumps(entity, sort_keys=True, default=str).encode("utf-8"), digest_size=16).hexdigest()
+
 class DataAccess:
     def __init__(self):
         self._sobject_fields = {}
+        self._sobject_converters = {}
+        self._csv_row_converters = {}
+        self._sobject_fields_last_modified = {}
+        self._sobject_fields_loaded_at = {}
+        self._describe_locks = {}
+        self._describe_locks_lock = threading.Lock()
+
+    def _build_converter(self, fields):
+        '''returns the list of (field name, conversion function) pairs for the fields that need conversion'''
+        return [(f["name"], FIELD_TYPE_CONVERTERS[f["type"]]) for f in fields if f.get("type") in FIELD_TYPE_CONVERTERS]
+
+    def _build_csv_row_converter(self, datatype, columns):
+        '''returns a function that turns a Bulk API CSV row into the same shape as a REST query row'''
+        field_types = {f["name"]: f.get("type") for f in self._sobject_fields.get(datatype, [])}
+        plan = [(column, column.split("."), BULK_CSV_FIELD_CASTS.get(field_types.get(column))) for column in columns]
+        url_prefix = f"/services/data/v{API_VERSION}/sobjects/{datatype}/"
+
+        def _convert(csv_row):
+            row = OrderedDict([("attributes", {"type": datatype, "url": url_prefix + csv_row.get("Id", "")})])
+            relationships = set()
+            for column, path, cast in plan:
+                value = csv_row[column]
+                if value == "":
+                    value = None
+                elif cast:
+                    value = cast(value)
+                if len(path) > 1:
+                    relationships.add(path[0])
+                target = row
+                for p in path[:-1]:
+                    target = target.setdefault(p, OrderedDict())
+                target[path[-1]] = value
+            for p in relationships:
+                if not any(v is not None for v in row[p].values()):
+                    row[p] = None
+            return row
+        return _convert
+
+    def _from_csv_rows(self, datatype, csv_rows):
+        for csv_row in csv_rows:
+            columns = tuple(csv_row.keys())
+            convert = self._csv_row_converters.get((datatype, columns))
+            if not convert:
+                convert = self._build_csv_row_converter(datatype, columns)
+                self._csv_row_converters[(datatype, columns)] = convert
+            yield convert(csv_row)
 
     def sesamify(self, entity, datatype=None):
         entity.update({"_id": entity.get("Id")})
 
-        for property, value in entity.items():
-            schema = [item for item in self._sobject_fields.get(datatype, []) if item.get("name") == property]
-            if value and len(schema) > 0 and "type" in schema[0] and schema[0]["type"] == "datetime":
-                if isinstance(value, int):
-                    entity[property] = to_transit_datetime(datetime.fromtimestamp(value/1000))
-                elif isinstance(value, str):
-                    entity[property] = to_transit_datetime(parse(value))
+        for property, convert in self._sobject_converters.get(datatype, []):
+            value = entity.get(property)
+            if value:
+                entity[property] = convert(value)
 
         entity.update({"_updated": "%s" % (entity.get("SystemModstamp") or entity.get("CreatedDate"))})
         entity.update({"_deleted": entity.get("IsDeleted")})
@@ -76,51 +827,366 @@ class DataAccess:
 
             return input
     
-    def reload_fields_metadata(self, sf, datatype):
+    def _set_fields_metadata(self, datatype, fields, last_modified=None):
+        self._sobject_fields[datatype] = fields
+        self._sobject_converters[datatype] = self._build_converter(fields)
+        self._sobject_fields_last_modified[datatype] = last_modified
+        for key in [k for k in self._csv_row_converters.keys() if k[0] == datatype]:
+            self._csv_row_converters.pop(key, None)
+
+    def _is_fields_metadata_fresh(self, datatype):
         if self._sobject_fields.get(datatype, []) == []:
-            fields = [dict(f) for f in getattr(sf, datatype).describe()["fields"]]
-            self._sobject_fields[datatype] = fields
+            return False
+        ttl = int(SF_OBJECTS_CONFIG.get(datatype, {}).get("describe_cache_ttl", DESCRIBE_CACHE_TTL))
+        return ttl <= 0 or time.time() - self._sobject_fields_loaded_at.get(datatype, 0) < ttl
+
+    def reload_fields_metadata(self, sf, datatype):
+        '''describes the sobject unless its cached metadata is younger than the TTL. Expired metadata is revalidated
+            with If-Modified-Since. Concurrent calls for the same sobject wait for a single describe call.'''
+        if self._is_fields_metadata_fresh(datatype):
+            metrics.inc("salesforce_cache_requests_total", {"cache": "describe", "result": "hit"})
+            return
+        with self._describe_locks_lock:
+            describe_lock = self._describe_locks.setdefault(datatype, threading.Lock())
+        with describe_lock:
+            if self._is_fields_metadata_fresh(datatype):
+                return
+            sobject = getattr(sf, datatype)
+            headers = {}
+            if self._sobject_fields.get(datatype) and self._sobject_fields_last_modified.get(datatype):
+                headers["If-Modified-Since"] = self._sobject_fields_last_modified[datatype]
+            try:
+                with timed("describe"):
+                    response = sobject._call_salesforce("GET", sobject.base_url + "describe", headers=headers)
+                self._set_fields_metadata(datatype, [dict(f) for f in response.json()["fields"]], response.headers.get("Last-Modified"))
+                metrics.inc("salesforce_cache_requests_total", {"cache": "describe", "result": "miss"})
+                logger.debug(f"loaded describe metadata of {datatype}")
+            except SalesforceError as err:
+                if err.status != 304:
+                    raise
+                metrics.inc("salesforce_cache_requests_total", {"cache": "describe", "result": "revalidated"})
+                logger.debug(f"describe metadata of {datatype} is not modified")
+            self._sobject_fields_loaded_at[datatype] = time.time()
+            self.save_fields_metadata_snapshot()
+
+    def load_fields_metadata_snapshot(self):
+        if not DESCRIBE_CACHE_PATH or not os.path.exists(DESCRIBE_CACHE_PATH):
+            return
+        with open(DESCRIBE_CACHE_PATH) as f:
+            snapshot = json.load(f)
+        for datatype, metadata in snapshot.items():
+            self._set_fields_metadata(datatype, metadata["fields"], metadata.get("last_modified"))
+            self._sobject_fields_loaded_at[datatype] = metadata.get("loaded_at", 0)
+        logger.info(f"loaded describe metadata of {len(snapshot)} sobjects from {DESCRIBE_CACHE_PATH}")
+
+    def save_fields_metadata_snapshot(self):
+        if not DESCRIBE_CACHE_PATH:
+            return
+        with self._describe_locks_lock:
+            snapshot = {datatype: {"fields": fields,
+                                   "last_modified": self._sobject_fields_last_modified.get(datatype),
+                                   "loaded_at": self._sobject_fields_loaded_at.get(datatype, 0)}
+                        for datatype, fields in list(self._sobject_fields.items())}
+            with open(DESCRIBE_CACHE_PATH + ".tmp", "w") as f:
+                json.dump(snapshot, f)
+            os.replace(DESCRIBE_CACHE_PATH + ".tmp", DESCRIBE_CACHE_PATH)
+
+    def prewarm_fields_metadata(self, sf_getter, datatypes):
+        for datatype in datatypes:
+            try:
+                self.reload_fields_metadata(sf_getter(), datatype)
+            except Exception as err:
+                logger.warning(f"could not prewarm describe metadata of {datatype}: {err}")
 
     def get_entities(self, sf, datatype, query_config=None, objectkey=None):
         try:
-            yield '['
-            yield from self.get_entitiesdata(sf, datatype, query_config, objectkey)
-            yield ']'
+            yield from iter_json_array_chunks(self.get_entitiesdata(sf, datatype, query_config, objectkey))
         except SalesforceResourceNotFound as e:
             abort(404, str(e))
 
     def get_entitiesdata(self, sf, datatype, query_config=None, objectkey=None):
-        isFirst = True
+        '''yields the sesamified entities encoded as JSON'''
         if objectkey:
             obj = getattr(sf, datatype).get(objectkey)
-            yield json.dumps(self.sesamify(obj, datatype))
+            yield encode_json(self.sesamify(obj, datatype))
         else:
             extra_attributes = query_config.get("extra_attributes",[])
-            select_clause = ",".join([f["name"] for f in self._sobject_fields[datatype]] + extra_attributes)
+            selected_fields = self._get_selected_fields(datatype, query_config.get("fields"))
+            select_clause = to_select_clause([f["name"] for f in selected_fields] + extra_attributes)
             updatedFieldInSF = "SystemModstamp" if "SystemModstamp" in [f["name"] for f in self._sobject_fields[datatype]] else "CreatedDate"
             conditions = []
             filters = query_config.get("filters",{})
-            if filters.get("since"):
-                sinceDateTimeStr = parse(to_nontransit_datetime(filters.get("since"))).isoformat()
+            since_cursor = parse_since_cursor(filters["since"]) if filters.get("since") else None
+            if since_cursor:
+                conditions.append(self._get_keyset_condition(updatedFieldInSF, *since_cursor))
+            elif filters.get("since"):
+                sinceDateTimeStr = parse_datetime(to_nontransit_datetime(filters.get("since"))).isoformat()
                 conditions.append(f"{updatedFieldInSF}>={sinceDateTimeStr}")
             if filters.get("where"):
-                conditions.append(filters.get("where"))
-            where_clause = "where {}".format(" AND ".join(conditions)) if conditions else ""
+                conditions.append(f"({filters.get('where')})")
+
+            object_config = SF_OBJECTS_CONFIG.get(datatype, {})
+            use_since_cursor = object_config.get("since_cursor", SINCE_CURSOR)
+            chunk_count = int(object_config.get("parallel_query_chunks", 1))
+            if self._use_bulk_query(sf, datatype, conditions):
+                select_clause = to_select_clause([f["name"] for f in selected_fields
+                    if f.get("type") not in BULK_QUERY_UNSUPPORTED_FIELD_TYPES] + extra_attributes)
+                where_clause = to_where_clause(conditions)
+                query = f"select {select_clause} from {datatype} {where_clause} order by {updatedFieldInSF},Id"
+                logger.debug(f"bulk query:{query}")
+                engine = "bulk"
+                result = self._from_csv_rows(datatype, bulk2_query_iter(sf, query, include_deleted=True))
+            elif chunk_count > 1:
+                chunks = self._get_chunk_conditions(sf, datatype, conditions, updatedFieldInSF, chunk_count)
+                engine = "parallel"
+                result = iter_concurrently(
+                    [self._query_factory(sf, datatype, select_clause, c, updatedFieldInSF) for c in chunks],
+                    max_workers=int(object_config.get("parallel_query_max_workers", 4)),
+                    ordered=object_config.get("parallel_query_ordered", True),
+                    buffer_size=int(object_config.get("parallel_query_buffer_rows", PARALLEL_QUERY_BUFFER_ROWS)))
+            elif use_since_cursor:
+                engine = "keyset"
+                result = self._keyset_query_iter(sf, datatype, select_clause, conditions, updatedFieldInSF)
+            else:
+                engine = "rest"
+                result = self._query_factory(sf, datatype, select_clause, conditions, updatedFieldInSF)()
+            do_index = external_id_index and SF_OBJECTS_CONFIG.get(datatype, {}).get("ordered_key_fields")
+            rows_to_index = []
+            row_count = 0
+            profile = get_profile()
+            try:
+                if result:
+                    for row in (timed_iter(result, profile, "query") if profile else result):
+                        row_count += 1
+                        if do_index:
+                            rows_to_index.append(row)
+                            if len(rows_to_index) >= 1000:
+                                index_external_ids(datatype, rows_to_index)
+                                rows_to_index = []
+                        cursor = to_since_cursor(row[updatedFieldInSF], row["Id"]) if use_since_cursor else None
+                        if profile:
+                            yield self._encode_entity_profiled(row, datatype, cursor, profile)
+                        else:
+                            yield self._encode_entity(row, datatype, cursor)
+                if rows_to_index:
+                    index_external_ids(datatype, rows_to_index)
+            finally:
+                metrics.inc("salesforce_rows_streamed_total", {"sobject": datatype, "engine": engine}, row_count)
+        return
 
-            query = f"select {select_clause} from {datatype} {where_clause} order by {updatedFieldInSF}"
+    def _encode_entity(self, row, datatype, cursor=None):
+        entity = self.sesamify(row, datatype)
+        if cursor:
+            entity["_updated"] = cursor
+        return encode_json(entity)
+
+    def _encode_entity_profiled(self, row, datatype, cursor, profile):
+        started_at = time.perf_counter()
+        entity = self.sesamify(row, datatype)
+        if cursor:
+            entity["_updated"] = cursor
+        sesamified_at = time.perf_counter()
+        encoded = encode_json(entity)
+        profile.add("sesamify", sesamified_at - started_at)
+        profile.add("encode", time.perf_counter() - sesamified_at)
+        return encoded
+
+    def _get_selected_fields(self, datatype, requested_fields=None):
+        '''returns the describe entries of the fields to select. Fields given in the request take precedence over
+            'include_fields'/'exclude_fields' of the sobject config. 'skip_large_fields' defaults to true when
+            the sobject config has a projection. REQUIRED_FIELDS are always selected.'''
+        fields = self._sobject_fields[datatype]
+        object_config = SF_OBJECTS_CONFIG.get(datatype, {})
+        requested_fields = [name.strip() for name in requested_fields or [] if name.strip()]
+        if requested_fields:
+            # field names are case-insensitive in SOQL
+            field_names = set(name.lower() for name in requested_fields + REQUIRED_FIELDS)
+            known_names = set(f["name"].lower() for f in fields)
+            return [f for f in fields if f["name"].lower() in field_names] + \
+                [{"name": name} for name in requested_fields if name.lower() not in known_names]
+        include_fields = object_config.get("include_fields")
+        exclude_fields = object_config.get("exclude_fields", [])
+        skip_large_fields = object_config.get("skip_large_fields", bool(include_fields or exclude_fields))
+        # field names are case-insensitive in SOQL, so they are in the sobject config too
+        included_names = set(name.lower() for name in include_fields) if include_fields is not None else None
+        excluded_names = set(name.lower() for name in exclude_fields)
+        selected_fields = []
+        for f in fields:
+            if f["name"] not in REQUIRED_FIELDS:
+                if included_names is not None and f["name"].lower() not in included_names:
+                    continue
+                if f["name"].lower() in excluded_names:
+                    continue
+                if skip_large_fields and (f.get("type") in LARGE_FIELD_TYPES
+                        or (f.get("type") == "textarea" and f.get("length", 0) > LARGE_TEXTAREA_LENGTH)):
+                    continue
+            selected_fields.append(f)
+        return selected_fields
+
+    def _use_bulk_query(self, sf, datatype, conditions):
+        '''Bulk API is used if the sobject is configured with query_engine 'bulk',
+            or if the expected row count is above the bulk query threshold'''
+        object_config = SF_OBJECTS_CONFIG.get(datatype, {})
+        if object_config.get("query_engine"):
+            return object_config["query_engine"] == "bulk"
+        bulk_query_threshold = int(object_config.get("bulk_query_threshold", DEFAULT_BULK_QUERY_THRESHOLD))
+        if bulk_query_threshold <= 0:
+            return False
+        where_clause = to_where_clause(conditions)
+        expected_count = sf.query(f"select count() from {datatype} {where_clause}", include_deleted=True)["totalSize"]
+        logger.debug(f"expected row count for {datatype} is {expected_count}")
+        return bulk_query_threshold < expected_count
+
+    def _query_factory(self, sf, datatype, select_clause, conditions, updatedFieldInSF):
+        def _query():
+            where_clause = to_where_clause(conditions)
+            query = f"select {select_clause} from {datatype} {where_clause} order by {updatedFieldInSF},Id"
             logger.debug(f"query:{query}")
-            result = sf.query_all_iter(query, include_deleted=True)
-            if result:
-                for row in result:
-                    if not isFirst:
-                        yield ',\n'
-                    else:
-                        isFirst = False
-                    yield json.dumps(self.sesamify(row, datatype))
-        return
+            return sf.query_all_iter(query, include_deleted=True)
+        return _query
+
+    def _get_keyset_condition(self, updatedFieldInSF, updated, sf_id):
+        '''returns the condition matching the rows that come after (updated, Id) in the query order'''
+        return f"({updatedFieldInSF}>{updated} or ({updatedFieldInSF}={updated} and Id>{soql_quote(sf_id)}))"
+
+    def _keyset_query_iter(self, sf, datatype, select_clause, conditions, updatedFieldInSF):
+        '''queries in pages of KEYSET_PAGE_SIZE rows. Each page continues after the (updatedFieldInSF, Id) of the last
+            row of the previous page instead of following a query locator, so rows sharing a timestamp are never
+            skipped or repeated at page boundaries.'''
+        page_conditions = conditions
+        while True:
+            where_clause = to_where_clause(page_conditions)
+            query = f"select {select_clause} from {datatype} {where_clause} order by {updatedFieldInSF},Id limit {KEYSET_PAGE_SIZE}"
+            logger.debug(f"query:{query}")
+            row_count = 0
+            last_key = None
+            for row in sf.query_all_iter(query, include_deleted=True):
+                row_count += 1
+                # read before yielding since the caller converts the row in place
+                last_key = (row[updatedFieldInSF], row["Id"])
+                yield row
+            if row_count < KEYSET_PAGE_SIZE:
+                return
+            updated, sf_id = parse_since_cursor(to_since_cursor(*last_key))
+            page_conditions = conditions + [self._get_keyset_condition(updatedFieldInSF, updated, sf_id)]
+
+    def _get_chunk_conditions(self, sf, datatype, conditions, updatedFieldInSF, chunk_count):
+        '''splits the range of updatedFieldInSF values matching the conditions into chunk_count consecutive ranges.
+            Returns the conditions of each chunk in chronological order.'''
+        where_clause = to_where_clause(conditions)
+        query = f"select min({updatedFieldInSF}) minValue, max({updatedFieldInSF}) maxValue from {datatype} {where_clause}"
+        logger.debug(f"query:{query}")
+        records = sf.query_all(query, include_deleted=True).get("records", [])
+        if not records or not records[0].get("minValue") or not records[0].get("maxValue"):
+            return [conditions]
+        min_value = parse_datetime(records[0]["minValue"]).astimezone(timezone.utc)
+        max_value = parse_datetime(records[0]["maxValue"]).astimezone(timezone.utc)
+        step = (max_value - min_value) / chunk_count
+        boundaries = sorted(set([datetime_format(min_value + step * i) for i in range(1, chunk_count)]))
+
+        chunks = []
+        lower_boundary = None
+        for upper_boundary in boundaries + [None]:
+            chunk_conditions = list(conditions)
+            if lower_boundary:
+                chunk_conditions.append(f"{updatedFieldInSF}>={lower_boundary}")
+            if upper_boundary:
+                chunk_conditions.append(f"{updatedFieldInSF}<{upper_boundary}")
+            chunks.append(chunk_conditions)
+            lower_boundary = upper_boundary
+        logger.debug(f"split {datatype} query into {len(chunks)} chunks at {boundaries}")
+        return chunks
 
 data_access_layer = DataAccess()
 
+def iter_json_array(stream, read_size=65536):
+    '''parses a JSON array from a binary stream while it is read and yields its items one by one.
+        A JSON value that is not an array is yielded as the only item.'''
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def _fill():
+        nonlocal buffer, pos, eof
+        data = stream.read(read_size)
+        eof = not data
+        buffer = buffer[pos:] + text_decoder.decode(data, final=eof)
+        pos = 0
+
+    def _skip_whitespace():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(buffer) or eof:
+                return
+            _fill()
+
+    def _decode_value():
+        nonlocal pos
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+                # a value that is not followed by a delimiter, fex a number, might continue in the next read
+                if eof or (end < len(buffer) and buffer[end] in " \t\r\n,]"):
+                    pos = end
+                    return value
+            except ValueError:
+                if eof:
+                    raise
+            _fill()
+
+    def _expect_end():
+        _skip_whitespace()
+        if pos < len(buffer):
+            raise ValueError(f"extra data after JSON value: {buffer[pos:pos + 20]!r}")
+
+    _skip_whitespace()
+    if pos >= len(buffer):
+        return
+    if buffer[pos] != "[":
+        yield _decode_value()
+        _expect_end()
+        return
+    pos += 1
+    _skip_whitespace()
+    if buffer[pos:pos + 1] == "]":
+        pos += 1
+        _expect_end()
+        return
+    while True:
+        yield _decode_value()
+        _skip_whitespace()
+        separator = buffer[pos:pos + 1]
+        pos += 1
+        if separator == "]":
+            _expect_end()
+            return
+        elif separator != ",":
+            raise ValueError(f"expected ',' or ']' in JSON array, got {separator!r}")
+        _skip_whitespace()
+
+class InvalidRequest(Exception):
+    '''raised when the body or headers of a request can not be parsed'''
+    status = 400
+
+def iter_request_entities(stream):
+    '''iter_json_array that raises InvalidRequest if the body is not valid JSON'''
+    try:
+        yield from iter_json_array(stream)
+    except ValueError as err:
+        raise InvalidRequest(f"invalid JSON in request body: {err}")
+
+def iter_chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
 def get_request_data(request):
     if not request.data:
         return None
@@ -131,7 +1197,187 @@ def get_request_data(request):
         return request.get_json()
 
 
-def transform(datatype, entities, sf, operation_in="POST", objectkey_in=None, do_create_if_key_is_empty=False):
+class RecordFailures(Exception):
+    '''raised when some of the records of a batch could not be written'''
+    def __init__(self, failures):
+        self.failures = failures
+        super().__init__(json.dumps(failures))
+
+def _collection_request(sf, datatype, operation, key_field, records):
+    '''sends one sObject Collections request, returns the results in the order of the records'''
+    if operation == "delete":
+        return sf.restful("composite/sobjects", {"ids": ",".join(records), "allOrNone": "false"}, method="DELETE")
+    body = {"allOrNone": False, "records": records}
+    if operation == "create":
+        return sf.restful("composite/sobjects", method="POST", json=body)
+    elif operation == "update":
+        return sf.restful("composite/sobjects", method="PATCH", json=body)
+    else:
+        return sf.restful(f"composite/sobjects/{datatype}/{key_field}", method="PATCH", json=body)
+
+def _split_by_unique_key(writes):
+    '''splits the (operation, key_field, objectkey, record) writes into consecutive rounds where no record is written
+        twice, so that repeated writes to the same record keep their order. A record is identified by its objectkey
+        and, where it is known, its Id.'''
+    rounds = [[]]
+    seen_keys = set()
+    for write in writes:
+        operation, _, objectkey, record = write
+        keys = {objectkey, record if operation == "delete" else record.get("Id")} - {None}
+        if keys & seen_keys:
+            rounds.append([])
+            seen_keys = set()
+        seen_keys |= keys
+        rounds[-1].append(write)
+    return rounds
+
+def is_already_deleted(errors):
+    '''true if the errors of a failed delete only say that the record does not exist(any more). Such deletes count
+        as done, like the 404 of a single DELETE. Takes the error list of the REST API or the error string of Bulk API 2.0.'''
+    if isinstance(errors, str):
+        return errors.split(":", 1)[0] in ALREADY_DELETED_ERROR_CODES
+    return bool(errors) and all(e.get("statusCode") in ALREADY_DELETED_ERROR_CODES for e in errors)
+
+def write_in_collections(sf, datatype, writes):
+    '''writes the (operation, key_field, objectkey, record) tuples via sObject Collections requests of up to
+        COLLECTIONS_BATCH_SIZE records, running at most REST_COLLECTIONS_MAX_WORKERS requests at a time. The writes are
+        done in rounds where no record occurs twice, so writes to the same record are done in input order.
+        Deletes are given the Id as record. Returns the failed writes with their errors.'''
+    failures = []
+    with ThreadPoolExecutor(max_workers=REST_COLLECTIONS_MAX_WORKERS) as executor:
+        for round_writes in _split_by_unique_key(writes):
+            groups = OrderedDict()
+            for operation, key_field, objectkey, record in round_writes:
+                groups.setdefault((operation, key_field), []).append((objectkey, record))
+            futures = []
+            for (operation, key_field), keyed_records in groups.items():
+                batches = [keyed_records[i:i + COLLECTIONS_BATCH_SIZE] for i in range(0, len(keyed_records), COLLECTIONS_BATCH_SIZE)]
+                logger.debug(f"performing {operation} on {len(keyed_records)} {datatype} in {len(batches)} collection requests")
+                futures += [(operation, key_field, batch,
+                    executor.submit(_collection_request, sf, datatype, operation, key_field, [r for _, r in batch]))
+                    for batch in batches]
+            failed_deletes = {}
+            for operation, key_field, batch, future in futures:
+                results = future.result()
+                if operation == "upsert" and external_id_index:
+                    external_id_index.put_many(datatype, key_field,
+                        [(record[key_field], result.get("id")) for (_, record), result in zip(batch, results) if result.get("success")])
+                if operation == "delete" and external_id_index:
+                    external_id_index.delete_ids(datatype, [sf_id for _, sf_id in batch])
+                for (objectkey, record), result in zip(batch, results):
+                    if result.get("success"):
+                        continue
+                    if operation == "delete" and key_field != "Id" and external_id_index:
+                        failed_deletes.setdefault(key_field, []).append(
+                            (urlparser.unquote(objectkey.split("/", 1)[1]), record, result.get("errors")))
+                    elif not (operation == "delete" and is_already_deleted(result.get("errors"))):
+                        failures.append({"objectkey": objectkey, "operation": operation, "errors": result.get("errors")})
+            for key_field, deletes in failed_deletes.items():
+                for value, errors in redelete_with_fresh_ids(sf, datatype, key_field, deletes):
+                    if not is_already_deleted(errors):
+                        failures.append({"objectkey": f"{key_field}/{urlparser.quote(value)}", "operation": "delete", "errors": errors})
+    return failures
+
+def write_in_bulk(sf, datatype, operation, records_per_key_field):
+    '''runs one bulk job per key field, at most 'bulk_max_workers' of them at a time.
+        Returns the failed records with their errors, deletes of records that are already gone are not failures.'''
+    object_config = SF_OBJECTS_CONFIG.get(datatype, {})
+    batch_size = int(object_config.get("bulk_batch_size", 10000))
+
+    def _run(key_field, records):
+        failed = _run_job(key_field, records)
+        if operation == "delete" and external_id_index:
+            external_id_index.delete_ids(datatype, [r["Id"] for r in records])
+            if key_field != "Id" and failed:
+                id_per_key = {r.get(key_field): r["Id"] for r in records}
+                failed = redelete_with_fresh_ids(sf, datatype, key_field, [(key, id_per_key.get(key), errors) for key, errors in failed])
+        return failed
+
+    def _run_job(key_field, records):
+        if object_config.get("bulk_api") == "bulk2":
+            failed = []
+            for i in range(0, len(records), batch_size):
+                batch = records[i:i + batch_size] if operation == "upsert" else [{"Id": r["Id"]} for r in records[i:i + batch_size]]
+                failed += bulk2_ingest(sf, datatype, operation, batch, key_field if operation == "upsert" else None)
+            if operation == "delete":
+                # only the Id is uploaded for deletes
+                key_per_id = {r["Id"]: r.get(key_field) for r in records}
+                return [(key_per_id.get(r.get("Id") or r.get("sf__Id")), r.get("sf__Error")) for r in failed]
+            return [(r.get(key_field) or r.get("sf__Id"), r.get("sf__Error")) for r in failed]
+        bulk_type = getattr(sf.bulk, datatype)
+        use_serial = object_config.get("bulk_use_serial", True)
+        if operation == "upsert":
+            results = bulk_type.upsert(records, key_field, batch_size=batch_size, use_serial=use_serial)
+            if external_id_index and key_field != "Id":
+                external_id_index.put_many(datatype, key_field,
+                    [(record.get(key_field), result.get("id")) for record, result in zip(records, results) if result.get("success")])
+        else:
+            results = bulk_type.delete(records, batch_size=batch_size, use_serial=use_serial)
+        return [(record.get(key_field), result.get("errors")) for record, result in zip(records, results) if not result.get("success")]
+
+    failures = []
+    with ThreadPoolExecutor(max_workers=int(object_config.get("bulk_max_workers", 1))) as executor:
+        futures = [(key_field, executor.submit(_run, key_field, records))
+            for key_field, records in records_per_key_field.items() if records]
+        for key_field, future in futures:
+            for key, errors in future.result():
+                if operation == "delete" and is_already_deleted(errors):
+                    continue
+                failures.append({"objectkey": key if key_field == "Id" else f"{key_field}/{key}", "operation": operation, "errors": errors})
+    return failures
+
+def get_bulk_switch_threshold(datatype):
+    '''returns the number of entities above which bulk api is used, 0 if bulk api is disabled'''
+    if DEFAULT_BULK_SWITCH_THRESHOLD > 0:
+        return int(SF_OBJECTS_CONFIG.get(datatype, {}).get("bulk_switch_threshold", DEFAULT_BULK_SWITCH_THRESHOLD))
+    return 0
+
+def _get_write_key(datatype, entity, objectkey_in=None):
+    '''returns 'Id/<Id>' or '<first ordered key field with a value>/<value>', objectkey_in if the entity has neither'''
+    if entity.get("Id"):
+        return f"Id/{entity['Id']}"
+    for k in SF_OBJECTS_CONFIG.get(datatype, {}).get("ordered_key_fields", []):
+        if entity.get(k):
+            return f"{k}/{entity[k]}"
+    return objectkey_in
+
+def dedup_writes(datatype, listing, operation_in, objectkey_in=None):
+    '''collapses the entities with the same key to the last one and drops the upserts whose content equals the last
+        successful write of the key. Returns the remaining entities and the (key, content hash) pairs to store once
+        they are written. The cached hashes of deleted keys are dropped right away.'''
+    kept = []
+    seen_keys = set()
+    for e in reversed(listing):
+        key = _get_write_key(datatype, e, objectkey_in)
+        if key is not None:
+            if key in seen_keys:
+                continue
+            seen_keys.add(key)
+        kept.append((key, e))
+    kept.reverse()
+
+    remaining = []
+    written_hashes = []
+    deleted_keys = []
+    for key, e in kept:
+        if key is None:
+            remaining.append(e)
+        elif operation_in == "DELETE" or e.get("_deleted", False):
+            deleted_keys.append(key)
+            remaining.append(e)
+        else:
+            entity_hash = content_hash(data_access_layer.unsesamify(dict(e)))
+            if write_dedup_cache.get(datatype, key) != entity_hash:
+                remaining.append(e)
+                written_hashes.append((key, entity_hash))
+    write_dedup_cache.delete_many(datatype, deleted_keys)
+    metrics.inc("salesforce_cache_requests_total", {"cache": "write_dedup", "result": "hit"}, len(kept) - len(remaining))
+    metrics.inc("salesforce_cache_requests_total", {"cache": "write_dedup", "result": "miss"}, len(written_hashes))
+    logger.debug(f"{datatype}: {len(listing) - len(kept)} duplicate keys collapsed, "
+        f"{len(kept) - len(remaining)} unchanged entities skipped")
+    return remaining, written_hashes
+
+def transform(datatype, entities, sf, operation_in="POST", objectkey_in=None, do_create_if_key_is_empty=False, do_bulk=None):
 
     def _get_object_key(entity, objectkey_in=None, do_create_if_key_is_empty=False):
         '''if 'Id' is specified, use 'Id' as key,
@@ -159,21 +1405,40 @@ def transform(datatype, entities, sf, operation_in="POST", objectkey_in=None, do
 
         return entity, key
 
-    global ids
-    c = None
+    def _delete_by_object_key(objectkey):
+        logger.debug(f"performing DELETE on {datatype}/{objectkey}")
+        try:
+            getattr(sf, datatype).delete(objectkey)
+        except SalesforceResourceNotFound as err:
+                None
+        except Exception as err:
+            logger.debug(f"{datatype}/{objectkey} received exception of type {type(err).__name__}")
+        if external_id_index and objectkey:
+            if "/" in objectkey:
+                key_field, key_value = objectkey.split("/", 1)
+                external_id_index.delete_values(datatype, key_field, [urlparser.unquote(key_value)])
+            else:
+                external_id_index.delete_ids(datatype, [objectkey])
+
     listing = []
     if not isinstance(entities, list):
         listing.append(entities)
     else:
         listing = entities
 
-    doBulk = False
-    if DEFAULT_BULK_SWITCH_THRESHOLD > 0:
-        bulk_switch_threshold = DEFAULT_BULK_SWITCH_THRESHOLD
-        if datatype in SF_OBJECTS_CONFIG:
-            bulk_switch_threshold = SF_OBJECTS_CONFIG[datatype].get("bulk_switch_threshold", DEFAULT_BULK_SWITCH_THRESHOLD)
-        doBulk = bulk_switch_threshold < len(listing)
+    written_hashes = []
+    if write_dedup_cache and SF_OBJECTS_CONFIG.get(datatype, {}).get("write_dedup", True):
+        listing, written_hashes = dedup_writes(datatype, listing, operation_in, objectkey_in)
+        if not listing:
+            return
 
+    doBulk = do_bulk
+    if doBulk is None:
+        bulk_switch_threshold = get_bulk_switch_threshold(datatype)
+        doBulk = 0 < bulk_switch_threshold < len(listing)
+
+    write_path = "bulk" if doBulk else "collections" if len(listing) > 1 else "single"
+    metrics.inc("salesforce_entities_written_total", {"sobject": datatype, "path": write_path}, len(listing))
     if doBulk:
         deleteListPerExternalId = {}
         upsertListPerExternalId = {}
@@ -201,42 +1466,64 @@ def transform(datatype, entities, sf, operation_in="POST", objectkey_in=None, do
                     "singleDeleteListPerExternalId": singleDeleteListPerExternalId}).items():
             for vk in v.keys():
                 logger.debug(f"length of {k}({vk}) = {str(len(v.get(vk)))}")
-        for externalId in deleteListPerExternalId.keys():
-            if deleteListPerExternalId.get(externalId):
-                bulkResult1 = getattr(sf.bulk, datatype).delete(deleteListPerExternalId.get(externalId), batch_size=10000, use_serial=True)
-
-        for externalId in upsertListPerExternalId.keys():
-            if upsertListPerExternalId.get(externalId):
-                bulkResult2 = getattr(sf.bulk, datatype).upsert(upsertListPerExternalId.get(externalId), externalId, batch_size=10000, use_serial=True)
-
         for externalId in singleDeleteListPerExternalId.keys():
             if singleDeleteListPerExternalId.get(externalId):
-                for objectkey in singleDeleteListPerExternalId.get(externalId):
-                    logger.debug(f"deleting {externalId}/{objectkey}")
-                    try:
-                        getattr(sf, datatype).delete(f"{externalId}/{objectkey}")
-                    except SalesforceResourceNotFound as err:
-                        None
-                    except Exception as err:
-                        logger.debug(f"{datatype}/{externalId}/{objectkey} received exception of type {type(err).__name__}")
+                resolved_ids = resolve_ids(sf, datatype, externalId, singleDeleteListPerExternalId.get(externalId))
+                deleteListPerExternalId[externalId] += [{"Id": resolved_ids[v], externalId: v}
+                    for v in singleDeleteListPerExternalId.get(externalId) if v in resolved_ids]
+        failures = write_in_bulk(sf, datatype, "delete", deleteListPerExternalId)
+        failures += write_in_bulk(sf, datatype, "upsert", upsertListPerExternalId)
+        if failures:
+            raise RecordFailures(failures)
+    elif len(listing) > 1:
+        writes = []
+        deletesPerExternalId = {}
+        for e in listing:
+            operation = "DELETE" if operation_in == "DELETE" or e.get("_deleted", False) else operation_in
+            object, objectkey = _get_object_key(e, objectkey_in, do_create_if_key_is_empty)
+            key_field, key_value = objectkey.split("/", 1) if objectkey and "/" in objectkey else ("Id", objectkey)
+            if operation == "DELETE":
+                if key_field == "Id" and objectkey:
+                    writes.append(("delete", "Id", objectkey, objectkey))
+                elif objectkey:
+                    deletesPerExternalId.setdefault(key_field, []).append(urlparser.unquote(key_value))
+                    writes.append(("delete", key_field, objectkey, urlparser.unquote(key_value)))
+                else:
+                    _delete_by_object_key(objectkey)
+                continue
+            record = OrderedDict([("attributes", {"type": datatype})])
+            record.update(object)
+            if do_create_if_key_is_empty and not objectkey:
+                writes.append(("create", None, objectkey, record))
+            elif key_field == "Id":
+                record["Id"] = key_value
+                writes.append(("update", "Id", objectkey, record))
+            else:
+                record[key_field] = urlparser.unquote(key_value)
+                writes.append(("upsert", key_field, objectkey, record))
+        # deletes by external id are sent by Id, the ones without a record are done already
+        idsPerExternalId = {k: resolve_ids(sf, datatype, k, v) for k, v in deletesPerExternalId.items()}
+        writes = [(op, k, objectkey, idsPerExternalId[k].get(r) if op == "delete" and k != "Id" else r)
+            for op, k, objectkey, r in writes]
+        writes = [w for w in writes if w[3] is not None]
+        failures = write_in_collections(sf, datatype, writes)
+        if failures:
+            raise RecordFailures(failures)
     else:
         for e in listing:
             operation = "DELETE" if operation_in == "DELETE" or e.get("_deleted", False) else operation_in
             object, objectkey = _get_object_key(e, objectkey_in, do_create_if_key_is_empty)
 
-            logger.debug(f"performing {operation} on {datatype}/{objectkey}")
             if operation == "DELETE":
-                try:
-                    getattr(sf, datatype).delete(objectkey)
-                except SalesforceResourceNotFound as err:
-                        None
-                except Exception as err:
-                    logger.debug(f"{datatype}/{objectkey} received exception of type {type(err).__name__}")
+                _delete_by_object_key(objectkey)
             else:
+                logger.debug(f"performing {operation} on {datatype}/{objectkey}")
                 if do_create_if_key_is_empty and not objectkey:
                     getattr(sf, datatype).create(object)
                 else:
                     getattr(sf, datatype).upsert(objectkey, object)
+    if written_hashes:
+        write_dedup_cache.put_many(datatype, written_hashes)
 
 def authenticate():
     """Sends a 401 response that enables basic auth"""
@@ -249,14 +1536,202 @@ def requires_auth(f):
     @wraps(f)
     def decorated(*args, **kwargs):
         auth = request.authorization
-        if not auth and (
-            not(get_var("USERNAME", "ENV") and get_var("PASSWORD", "ENV") and get_var("SECURITY_TOKEN", "ENV"))
-            and not get_var("LOGIN_CONFIG", "ENV")):
+        if not auth and not is_login_configured():
             return authenticate()
         return f(*args, **kwargs)
 
     return decorated
 
+def is_login_configured():
+    return bool((get_var("USERNAME", "ENV") and get_var("PASSWORD", "ENV") and get_var("SECURITY_TOKEN", "ENV"))
+        or get_var("LOGIN_CONFIG", "ENV"))
+
+
+class SalesforceService(Salesforce):
+    '''Salesforce client that lets only one thread log in again when the session expires.
+        Threads that got a 401 on the same session wait for that login and reuse its session.'''
+    def __init__(self, *args, **kwargs):
+        self._refresh_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def _refresh_session(self):
+        # simple_salesforce calls this right after the 401, so the session id the failed call was sent with is the one
+        # this thread last sent. Otherwise read from __dict__ since Salesforce.__getattr__ treats unset attributes as
+        # sobject names, and the first login runs from Salesforce.__init__ before session_id is set
+        authorization = self.session.get_sent_authorization() if isinstance(self.session, ThrottledSession) else None
+        expired_session_id = authorization[len("Bearer "):] if authorization else self.__dict__.get("session_id")
+        with self._refresh_lock:
+            if self.__dict__.get("session_id") != expired_session_id:
+                return
+            super()._refresh_session()
+            logger.debug("refreshed salesforce session")
+
+class TokenBucket:
+    '''allows rate calls per second on average and bursts of up to capacity calls'''
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1, rate))
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+class ApiScheduler:
+    '''throttles the calls to Salesforce. Each endpoint class can have a token bucket rate limit(API_RATE_LIMITS), and the
+        number of calls in flight is capped by a limit that grows by one per limit successful calls and is halved
+        when Salesforce signals overload(429, 503, REQUEST_LIMIT_EXCEEDED or API usage above API_USAGE_SOFT_LIMIT).'''
+    def __init__(self, max_concurrency, min_concurrency=1, rate_limits=None, usage_soft_limit=0.9):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency_limit = float(max_concurrency)
+        self.usage_soft_limit = usage_soft_limit
+        self.api_usage = None
+        self._buckets = {endpoint_class: TokenBucket(rate) for endpoint_class, rate in (rate_limits or {}).items()}
+        self._in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, endpoint_class):
+        bucket = self._buckets.get(endpoint_class)
+        if bucket:
+            bucket.acquire()
+        with self._condition:
+            while self._in_flight >= int(self.concurrency_limit):
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify()
+
+    def on_success(self):
+        with self._condition:
+            if self.concurrency_limit < self.max_concurrency:
+                self.concurrency_limit = min(self.max_concurrency, self.concurrency_limit + 1 / self.concurrency_limit)
+                self._condition.notify_all()
+
+    def on_overload(self, reason):
+        with self._condition:
+            self.concurrency_limit = max(self.min_concurrency, self.concurrency_limit / 2)
+        logger.warning(f"salesforce signalled overload({reason}), concurrency limit is now {int(self.concurrency_limit)}")
+
+    def on_limit_info(self, limit_info):
+        '''reads the Sforce-Limit-Info header, fex api-usage=25/15000'''
+        m = re.search(r"api-usage=(\d+)/(\d+)", limit_info)
+        if not m:
+            return False
+        used, total = int(m.group(1)), int(m.group(2))
+        self.api_usage = (used, total)
+        return total > 0 and used >= total * self.usage_soft_limit
+
+def get_endpoint_class(url):
+    path = urlparser.urlparse(url).path
+    if "/jobs/" in path or "/async/" in path:
+        return "bulk"
+    if "/tooling/" in path:
+        return "tooling"
+    if "/composite" in path:
+        return "composite"
+    if "/query" in path:
+        return "query"
+    if "/oauth2/" in path or "/Soap/" in path:
+        return "auth"
+    return "rest"
+
+def _is_overload_response(response):
+    if response.status_code in (429, 503):
+        return True
+    return response.status_code == 403 and b"REQUEST_LIMIT_EXCEEDED" in response.content[:1000] \
+        and b"oncurrent" in response.content[:1000]
+
+def _replayable_body(data):
+    '''returns a factory of the request body. Callables are factories already, generator and file bodies are read
+        into bytes since a retry would otherwise send what is left of them. Pass a factory to stream large bodies.'''
+    if callable(data):
+        return data
+    if hasattr(data, "read"):
+        data = data.read()
+    elif not isinstance(data, (bytes, str, dict, list, tuple)) and hasattr(data, "__iter__"):
+        data = b"".join(c.encode("utf-8") if isinstance(c, str) else c for c in data)
+    return lambda: data
+
+class ThrottledSession(requests.Session):
+    '''requests session that sends every call through the api_scheduler and retries the calls that Salesforce
+        rejected because of overload, with exponential backoff or after the 'Retry-After' seconds'''
+    def __init__(self, scheduler, retry_max=3, retry_backoff=1):
+        super().__init__()
+        self.scheduler = scheduler
+        self.retry_max = retry_max
+        self.retry_backoff = retry_backoff
+        self._sent = threading.local()
+
+    def get_sent_authorization(self):
+        '''returns the Authorization header of the last request sent by the calling thread'''
+        return getattr(self._sent, "authorization", None)
+
+    def request(self, method, url, *args, **kwargs):
+        endpoint_class = get_endpoint_class(url)
+        self._sent.authorization = (kwargs.get("headers") or {}).get("Authorization")
+        body = None
+        if kwargs.get("data") is not None and (self.retry_max or callable(kwargs["data"])):
+            body = _replayable_body(kwargs["data"])
+        attempt = 0
+        while True:
+            if body:
+                kwargs["data"] = body()
+            with timed("throttle"):
+                self.scheduler.acquire(endpoint_class)
+            started_at = time.perf_counter()
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            finally:
+                self.scheduler.release()
+                elapsed = time.perf_counter() - started_at
+                metrics.observe("salesforce_api_call_duration_seconds", {"endpoint_class": endpoint_class}, elapsed)
+                profile = get_profile()
+                if profile:
+                    profile.add(f"api_{endpoint_class}", elapsed)
+            metrics.inc("salesforce_api_calls_total", {"endpoint_class": endpoint_class, "status": response.status_code})
+            above_soft_limit = self.scheduler.on_limit_info(response.headers.get("Sforce-Limit-Info", ""))
+            if _is_overload_response(response):
+                self.scheduler.on_overload(f"{response.status_code} on {endpoint_class}")
+                if attempt < self.retry_max:
+                    retry_after = response.headers.get("Retry-After")
+                    delay = float(retry_after) if retry_after and retry_after.isdigit() \
+                        else random.uniform(0, self.retry_backoff * 2 ** attempt)
+                    attempt += 1
+                    metrics.inc("salesforce_api_retries_total", {"endpoint_class": endpoint_class})
+                    logger.debug(f"retrying {method} {url} in {delay:.2f}s, attempt {attempt}")
+                    response.close()
+                    time.sleep(delay)
+                    continue
+            elif above_soft_limit:
+                self.scheduler.on_overload(f"api usage {self.scheduler.api_usage[0]}/{self.scheduler.api_usage[1]}")
+            elif response.status_code < 400:
+                self.scheduler.on_success()
+            return response
+
+api_scheduler = ApiScheduler(API_MAX_CONCURRENCY, API_MIN_CONCURRENCY, API_RATE_LIMITS, API_USAGE_SOFT_LIMIT)
+
+def _new_http_session():
+    '''throttled requests session with a connection pool sized to the serving threads or the concurrent calls, shared by all Salesforce calls'''
+    session = ThrottledSession(api_scheduler, API_RETRY_MAX, API_RETRY_BACKOFF)
+    session.headers["Accept-Encoding"] = "gzip, deflate"
+    session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=max(WAITRESS_THREADS, ASGI_THREADS, API_MAX_CONCURRENCY)))
+    return session
+
+http_session = _new_http_session()
 
 def _refresh_sf():
     login_config = json.loads(get_var("LOGIN_CONFIG", "ENV"))
@@ -273,31 +1748,84 @@ def _refresh_sf():
     client_secret = login_config.get("CLIENT_SECRET")
     access_token = None
 
-    sf = Salesforce(username=username, 
+    sf = SalesforceService(username=username, 
                     password=password, 
                     security_token=security_token,
                     domain=domain, 
                     consumer_secret=client_secret,
                     consumer_key=client_id,
                     version=API_VERSION,
-                    session_id=access_token)
+                    session_id=access_token,
+                    session=http_session)
 
     return sf
 
 def get_sf():
+    '''returns the shared Salesforce client. Expired sessions are refreshed when a call gets a 401,
+        the SALESFORCE_SERVICE_REFRESHED_AT_INTERVAL(minutes) can be set to additionally log in again periodically'''
     global salesforce_service
     global salesforce_service_refreshed_at
-    do_relogin = not salesforce_service
-    if salesforce_service_refreshed_at:
-        delta = datetime.now(timezone.utc) - salesforce_service_refreshed_at
-        do_relogin = do_relogin or delta.seconds//60 >= salesforce_service_refreshed_at_interval
-    if do_relogin:
-        salesforce_service = _refresh_sf()
-        salesforce_service_refreshed_at = datetime.now(timezone.utc)
+    with salesforce_service_lock:
+        do_relogin = not salesforce_service
+        if salesforce_service_refreshed_at and salesforce_service_refreshed_at_interval > 0:
+            delta = datetime.now(timezone.utc) - salesforce_service_refreshed_at
+            do_relogin = do_relogin or delta.total_seconds()//60 >= salesforce_service_refreshed_at_interval
+        if do_relogin:
+            with timed("login"):
+                salesforce_service = _refresh_sf()
+            salesforce_service_refreshed_at = datetime.now(timezone.utc)
     logger.debug(f"do_relogin={do_relogin}, salesforce_service_refreshed_at={salesforce_service_refreshed_at}")
     return salesforce_service
 
 
+def _tooling_composite_batch(sf, method, paths_and_bodies):
+    '''sends one Tooling API composite request, returns the (status, body) of the subrequests in order'''
+    subrequests = []
+    for i, (path, body) in enumerate(paths_and_bodies):
+        subrequest = {"method": method, "url": f"/services/data/v{API_VERSION}/tooling/sobjects{path}", "referenceId": f"ref{i}"}
+        if body is not None:
+            subrequest["body"] = body
+        subrequests.append(subrequest)
+    response = sf.toolingexecute("composite", method="POST", data={"allOrNone": False, "compositeRequest": subrequests})
+    results = {r["referenceId"]: r for r in response["compositeResponse"]}
+    return [(results[f"ref{i}"]["httpStatusCode"], results[f"ref{i}"]["body"]) for i in range(len(subrequests))]
+
+def tooling_composite(sf, method, paths_and_bodies):
+    '''runs one subrequest per (tooling sobject path, body) pair in composite requests of up to
+        TOOLING_COMPOSITE_BATCH_SIZE, VALUESET_MAX_WORKERS requests at a time. Returns the response bodies in order.
+        If any subrequest fails, a SalesforceError listing all failures is raised once all have run.'''
+    batches = [paths_and_bodies[i:i + TOOLING_COMPOSITE_BATCH_SIZE] for i in range(0, len(paths_and_bodies), TOOLING_COMPOSITE_BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=VALUESET_MAX_WORKERS) as executor:
+        results = [r for batch_results in executor.map(lambda b: _tooling_composite_batch(sf, method, b), batches)
+            for r in batch_results]
+    failures = [{"path": path, "status": status, "errors": body}
+        for (path, _), (status, body) in zip(paths_and_bodies, results) if status >= 300]
+    if failures:
+        error_class = SalesforceResourceNotFound if failures[0]["status"] == 404 else SalesforceGeneralError
+        raise error_class(f"tooling/sobjects{failures[0]['path']}", failures[0]["status"], "ValueSet", json.dumps(failures))
+    return [body for _, body in results]
+
+# maps valueset paths to (loaded at, tooling sobject)
+valueset_cache = LRUCache(10000)
+
+def fetch_valuesets(sf, paths, max_age=0):
+    '''returns the tooling sobjects of the valuesets in the order of paths. Copies cached less than max_age seconds ago
+        are used instead of fetching.'''
+    now = time.time()
+    valuesets = {}
+    for path in paths:
+        cached = valueset_cache.get(path)
+        if max_age > 0 and cached and now - cached[0] < max_age:
+            valuesets[path] = cached[1]
+    missing = [path for path in OrderedDict.fromkeys(paths) if path not in valuesets]
+    metrics.inc("salesforce_cache_requests_total", {"cache": "valueset", "result": "hit"}, len(paths) - len(missing))
+    metrics.inc("salesforce_cache_requests_total", {"cache": "valueset", "result": "miss"}, len(missing))
+    if missing:
+        for path, valueset in zip(missing, tooling_composite(sf, "GET", [(path, None) for path in missing])):
+            valueset_cache.put(path, (now, valueset))
+            valuesets[path] = valueset
+    return [copy.deepcopy(valuesets[path]) for path in paths]
+
 def get_path_for_valueset(req):
     path_prefix_for_alias = "/ValueSet/SesamAlias/"
     if req.path.startswith(path_prefix_for_alias):
@@ -309,6 +1837,13 @@ def get_path_for_valueset(req):
     else:
         return request.path.replace("/ValueSet", "")
 
+def get_query_config(args):
+    '''reads the filters, extra_attributes and fields query params of a GET request'''
+    filters = {k: v for k, v in args.items() if k in["since","where"]}
+    extra_attributes = args.get("extra_attributes").split(",") if args.get("extra_attributes") else []
+    fields = args.get("fields").split(",") if args.get("fields") else None
+    return {"filters": filters, "extra_attributes": extra_attributes, "fields": fields}
+
 def respond_with_error(err):
     logger.exception(err)
 
@@ -320,6 +1855,44 @@ def respond_with_error(err):
     
     return Response(str(err), mimetype='plain/text', status=response_with_status)
 
+@app.before_request
+def start_request_timing():
+    g.started_at = time.perf_counter()
+    do_profile = PROFILE_REQUESTS or request.headers.get("X-Profile", "").lower() in ["true", "1"]
+    _profile_local.profile = RequestProfile() if do_profile else None
+
+@app.after_request
+def finish_request_timing(response):
+    '''observes the request duration once the response is sent, which for streamed responses is after the last row.
+        The stage timings of profiled requests are logged, and also returned in a 'Server-Timing' header
+        unless the response is streamed.'''
+    started_at = g.get("started_at", time.perf_counter())
+    labels = {"endpoint": request.endpoint, "method": request.method, "status": response.status_code}
+    profile = get_profile()
+    description = f"{request.method} {request.full_path}"
+    if profile and not response.is_streamed:
+        response.headers["Server-Timing"] = profile.to_server_timing()
+
+    def _on_close():
+        metrics.observe("salesforce_http_request_duration_seconds", labels, time.perf_counter() - started_at)
+        if profile:
+            logger.info(f"profile of {description}: {profile.to_server_timing()}")
+        _profile_local.profile = None
+    response.call_on_close(_on_close)
+    return response
+
+@app.route('/metrics', methods=["GET"], endpoint="metrics")
+@requires_auth
+def get_metrics():
+    if api_scheduler.api_usage:
+        metrics.set("salesforce_api_usage", None, api_scheduler.api_usage[0])
+        metrics.set("salesforce_api_limit", None, api_scheduler.api_usage[1])
+    metrics.set("salesforce_api_concurrency_limit", None, int(api_scheduler.concurrency_limit))
+    datetime_cache_info = _convert_datetime_value.cache_info()
+    metrics.set("salesforce_datetime_cache_hits", None, datetime_cache_info.hits)
+    metrics.set("salesforce_datetime_cache_misses", None, datetime_cache_info.misses)
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 
 @app.route('/ValueSet', methods=["GET"], endpoint="get_valueset_all")
 @app.route('/ValueSet/', methods=["GET"], endpoint="get_valueset_all/")
@@ -335,14 +1908,11 @@ def valueset_execute(sf_id_or_alias=None):
         do_refine = request.args.get("do_refine", "1").lower() not in ["0", "false", "no"]
 
         if request.endpoint.startswith("get_valueset_all"):
-            input_list = VALUESET_LIST.values()
+            input_list = list(VALUESET_LIST.values())
         else:
             input_list = [path]
         output_list = []
-        for vs in input_list:
-            tooling_api_response = sf.toolingexecute(
-                f"sobjects{vs}",
-                method=request.method)
+        for vs, tooling_api_response in zip(input_list, fetch_valuesets(sf, input_list)):
             response_data = {"path":vs,
                 "_id": vs}
             if do_refine:
@@ -389,29 +1959,39 @@ def valueset_execute_non_get(sf_id_or_alias=None):
 
         data = request.get_json()
         data = data if isinstance(data, list) else [data]
+        paths = [vs["path"] if do_read_path_from_data else path for vs in data]
 
-        for vs in data:
-            if do_read_path_from_data:
-                path = vs["path"]
-
-            pre_patch_data = sf.toolingexecute(
-                f"sobjects{path}",
-                method="GET")
-
+        # the pre-patch GET is skipped for valuesets read within VALUESET_CACHE_TTL
+        patches = OrderedDict()
+        for vs, path, pre_patch_data in zip(data, paths, fetch_valuesets(sf, paths, VALUESET_CACHE_TTL)):
             patch_data = pre_patch_data
             if request.endpoint == "global_valueset_by_id" or path.startswith("/GlobalValueSet/"):
+                is_unchanged = patch_data["Metadata"].get("customValue") == vs["data"]
                 patch_data["Metadata"]["customValue"] = vs["data"]
             elif request.endpoint == "custom_valueset_by_id" or path.startswith("/CustomField/"):
                 patch_data_temp = {}
                 patch_data_temp["Metadata"] = pre_patch_data["Metadata"]
+                is_unchanged = patch_data_temp["Metadata"]["valueSet"]["valueSetDefinition"].get("value") == vs["data"]
                 patch_data_temp["Metadata"]["valueSet"]["valueSetDefinition"]["value"] = vs["data"]
                 if not patch_data_temp["Metadata"]["valueSet"]["valueSettings"]:
                     patch_data_temp["Metadata"]["valueSet"]["valueSettings"] = []
                 patch_data = patch_data_temp
-            tooling_api_response = sf.toolingexecute(
-                f"sobjects{path}",
-                method="PATCH",
-                data=_updatable(patch_data))
+            else:
+                is_unchanged = False
+            if is_unchanged:
+                patches.pop(path, None)
+            else:
+                patches[path] = (pre_patch_data, patch_data)
+        logger.debug(f"patching {len(patches)} of {len(data)} valuesets, the rest are unchanged")
+        metrics.inc("salesforce_valuesets_unchanged_total", None, len(data) - len(patches))
+
+        now = time.time()
+        for path in patches:
+            valueset_cache.put(path, (0, None))
+        tooling_composite(sf, "PATCH", [(path, _updatable(copy.deepcopy(patch_data))) for path, (_, patch_data) in patches.items()])
+        # pre_patch_data holds the patched metadata too
+        for path, (pre_patch_data, _) in patches.items():
+            valueset_cache.put(path, (now, pre_patch_data))
         return Response("", mimetype='application/json', status=200)
 
     except Exception as err:
@@ -460,13 +2040,14 @@ def restful(path=None):
 def get_entities(datatype, objectkey=None, ext_id_field=None, ext_id=None):
     try:
         sf = get_sf()
-        filters = {k: v for k, v in request.args.items() if k in["since","where"]}
-        extra_attributes = request.args.get("extra_attributes").split(",") if request.args.get("extra_attributes") else []
-        query_config={"filters": filters, "extra_attributes": extra_attributes}
+        query_config = get_query_config(request.args)
         if request.endpoint == "get_by_ext_id":
             objectkey = f"{ext_id_field}/{ext_id}"
         data_access_layer.reload_fields_metadata(sf, datatype)
         entities = data_access_layer.get_entities(sf, datatype, query_config, objectkey)
+        if "gzip" in request.accept_encodings:
+            return Response(response=gzip_chunks(entities), mimetype='application/json',
+                headers={"Content-Encoding": "gzip", "Vary": "Accept-Encoding"})
         return Response(response=entities, mimetype='application/json')
     except Exception as err:
         return respond_with_error(err)
@@ -477,17 +2058,150 @@ def get_entities(datatype, objectkey=None, ext_id_field=None, ext_id=None):
 @requires_auth
 def receiver(datatype, objectkey=None, ext_id_field=None, ext_id=None):
     try:
-        entities = request.get_json()
+        entity_count_header = request.headers.get("X-Entity-Count")
+        if entity_count_header and not entity_count_header.strip().isdigit():
+            raise InvalidRequest(f"X-Entity-Count must be a non-negative integer, got {entity_count_header!r}")
+        entities = iter_request_entities(request.stream)
         sf = get_sf()
         if request.endpoint == "crud_by_ext_id":
             objectkey = f"{ext_id_field}/{ext_id}"
         if getattr(sf, datatype):
             do_create_if_key_is_empty = request.args.get("do_create_if_key_is_empty","").lower() in ["true","1"]
-            transform(datatype, entities, sf, operation_in=request.method, objectkey_in=objectkey, do_create_if_key_is_empty=do_create_if_key_is_empty)
+            # the bulk switch is decided on the X-Entity-Count header if sent, otherwise by reading ahead up to the threshold
+            bulk_switch_threshold = get_bulk_switch_threshold(datatype)
+            lookahead = []
+            if entity_count_header:
+                entity_count = int(entity_count_header)
+            elif bulk_switch_threshold > 0:
+                lookahead = list(itertools.islice(entities, bulk_switch_threshold + 1))
+                entity_count = len(lookahead)
+            else:
+                entity_count = 0
+            do_bulk = 0 < bulk_switch_threshold < entity_count
+            # the chunks that were written before a chunk that fails to parse stay written
+            failures = []
+            chunks = iter_chunks(itertools.chain(lookahead, entities), RECEIVER_CHUNK_SIZE)
+            profile = get_profile()
+            for chunk in (timed_iter(chunks, profile, "parse") if profile else chunks):
+                try:
+                    with timed("write"):
+                        transform(datatype, chunk, sf, operation_in=request.method, objectkey_in=objectkey,
+                            do_create_if_key_is_empty=do_create_if_key_is_empty, do_bulk=do_bulk)
+                except RecordFailures as err:
+                    failures += err.failures
+            if failures:
+                raise RecordFailures(failures)
         return Response("", mimetype='application/json')
     except Exception as err:
         return respond_with_error(err)
 
+class AsgiApp:
+    '''ASGI application of WEBFRAMEWORK=ASGI. Exports(GET /<datatype>) are streamed from the event loop, which borrows
+        one of ASGI_THREADS threads only to read and encode the next chunk of the response. A slow client or a long
+        export therefore holds no thread while its chunks are being sent, and the send waits until the client has
+        read the previous chunks. All other requests are served by the Flask app through a2wsgi.'''
+    def __init__(self, flask_app, threads=8):
+        from a2wsgi import WSGIMiddleware
+        self.wsgi_app = WSGIMiddleware(flask_app, workers=threads)
+        self.url_adapter = flask_app.url_map.bind("")
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="export")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self._lifespan(receive, send)
+        if scope["type"] == "http" and scope["method"] == "GET":
+            try:
+                endpoint, view_args = self.url_adapter.match(scope["path"], method="GET")
+            except HTTPException:
+                endpoint = None
+            if endpoint == "get_all":
+                return await self._export(scope, receive, send, view_args["datatype"])
+        await self.wsgi_app(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _send_response(self, send, response):
+        await send({"type": "http.response.start", "status": response.status_code,
+            "headers": [(k.encode("latin-1"), v.encode("latin-1")) for k, v in response.headers.items()]})
+        await send({"type": "http.response.body", "body": response.get_data()})
+
+    async def _export(self, scope, receive, send, datatype):
+        started_at = time.perf_counter()
+        loop = asyncio.get_event_loop()
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+        args = {}
+        for k, v in urlparser.parse_qsl(scope["query_string"].decode("utf-8"), keep_blank_values=True):
+            args.setdefault(k, v)
+        do_profile = PROFILE_REQUESTS or headers.get("x-profile", "").lower() in ["true", "1"]
+        profile = RequestProfile() if do_profile else None
+        do_gzip = "gzip" in headers.get("accept-encoding", "")
+        status = 200
+
+        def _run(f, *f_args):
+            # the profile is thread local, so it is set on whichever thread runs this step of the export
+            _profile_local.profile = profile
+            try:
+                return f(*f_args)
+            finally:
+                _profile_local.profile = None
+
+        def _open():
+            '''logs in, plans the query and reads the first chunk, so that errors are returned before streaming starts'''
+            sf = get_sf()
+            data_access_layer.reload_fields_metadata(sf, datatype)
+            chunks = data_access_layer.get_entities(sf, datatype, get_query_config(args))
+            if do_gzip:
+                chunks = gzip_chunks(chunks)
+            return chunks, next(chunks, None)
+
+        disconnected = asyncio.Event()
+        async def _watch_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+        watcher = asyncio.ensure_future(_watch_disconnect())
+        chunks = None
+        try:
+            if "authorization" not in headers and not is_login_configured():
+                response = authenticate()
+                status = response.status_code
+                return await self._send_response(send, response)
+            try:
+                chunks, chunk = await loop.run_in_executor(self.executor, _run, _open)
+            except Exception as err:
+                response = err.get_response() if isinstance(err, HTTPException) else respond_with_error(err)
+                status = response.status_code
+                return await self._send_response(send, response)
+            response_headers = [(b"content-type", b"application/json")]
+            if do_gzip:
+                response_headers += [(b"content-encoding", b"gzip"), (b"vary", b"Accept-Encoding")]
+            await send({"type": "http.response.start", "status": status, "headers": response_headers})
+            while chunk is not None and not disconnected.is_set():
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                chunk = await loop.run_in_executor(self.executor, _run, next, chunks, None)
+            if disconnected.is_set():
+                logger.info(f"client disconnected from the export of {datatype}")
+            else:
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            watcher.cancel()
+            if chunks is not None:
+                # runs the cleanup of the query, fex aborting or deleting a bulk query job that was not read to the end
+                await loop.run_in_executor(self.executor, _run, chunks.close)
+            metrics.observe("salesforce_http_request_duration_seconds",
+                {"endpoint": "get_all", "method": "GET", "status": status}, time.perf_counter() - started_at)
+            if profile:
+                logger.info(f"profile of GET {scope['path']}?{scope['query_string'].decode('utf-8')}: {profile.to_server_timing()}")
+
+
 if __name__ == '__main__':
     PORT = int(get_var('PORT', "ENV") or 5000)
     LOG_LEVEL = logging.getLevelName(get_var('LOG_LEVEL', "ENV") or "INFO")
@@ -503,12 +2217,18 @@ if __name__ == '__main__':
     else:
         raise Exception("Incomplete LOGIN_CONFIG definition!")
 
+    data_access_layer.load_fields_metadata_snapshot()
+    threading.Thread(target=data_access_layer.prewarm_fields_metadata, args=(get_sf, list(SF_OBJECTS_CONFIG.keys())), daemon=True).start()
+
     if get_var("WEBFRAMEWORK", "ENV") == "FLASK":
         app.run(debug=True, host='0.0.0.0', port=PORT)
+    elif get_var("WEBFRAMEWORK", "ENV") == "ASGI":
+        import uvicorn
+        uvicorn.run(AsgiApp(app, threads=ASGI_THREADS), host="0.0.0.0", port=PORT, lifespan="on")
     else:
         from waitress import serve
         from paste.translogger import TransLogger
 
         format = '"%(REQUEST_METHOD)s %(REQUEST_URI)s %(HTTP_VERSION)s" %(status)s %(bytes)s'
         time_format = "%Y-%m-%dT%H:%M:%S "
-        serve(TransLogger(app, format=format, time_format=time_format), host="0.0.0.0", port=PORT)
+        serve(TransLogger(app, format=format, time_format=time_format), host="0.0.0.0", port=PORT, threads=WAITRESS_THREADS)
@@ -0,0 +1,460 @@
+'''tests of the service, run with `python -m pytest` from the repository root'''
+from collections import OrderedDict
+import gzip
+import io
+import json
+import logging
+import threading
+import time
+
+import pytest
+import requests
+from dateutil.parser import parse
+from urllib3.response import HTTPResponse
+
+import service
+
+service.logger = logging.getLogger("salesforce")
+
+
+def dateutil_transit_datetime(value):
+    '''the datetime conversion of sesamify before parse_datetime, kept as the reference output'''
+    dt = parse(value)
+    return "~t" + '%04d' % dt.year + dt.strftime("-%m-%dT%H:%M:%SZ")
+
+DATETIME_CORPUS = [
+    # as returned by the REST API
+    "2024-01-01T12:00:00.000+0000",
+    "2024-02-29T23:59:59.999+0000",
+    "1970-01-01T00:00:00.000+0000",
+    "0999-01-01T00:00:00.000+0000",
+    "9999-12-31T23:59:59.999+0000",
+    # as returned by the Bulk API and in since filters
+    "2024-01-01T12:00:00Z",
+    "2024-01-01T12:00:00.000Z",
+    "2024-01-01T12:00:00.5Z",
+    "2024-01-01T12:00:00.123456Z",
+    # offsets, which are kept as they are in the transit value
+    "2024-01-01T12:00:00.123456+01:00",
+    "2024-01-01T12:00:00-0530",
+    "2024-01-01T23:30:00.000-1200",
+    "2024-01-01T00:15:00+1400",
+    "2024-01-01T12:00:00.000-0000",
+    # naive and other formats go through dateutil
+    "2024-01-01T12:00:00",
+    "2024-01-01",
+    "2024-01-01 12:00:00",
+    "Jan 5 2020 10:00",
+    "2024-01-01T12:00:00.1234567Z",
+]
+
+INVALID_DATETIMES = [
+    "2024-13-01T00:00:00Z",
+    "2023-02-29T00:00:00.000+0000",
+    "2024-01-01T24:00:00.000+0000",
+    "not a datetime",
+]
+
+@pytest.mark.parametrize("value", DATETIME_CORPUS)
+def test_parse_datetime_matches_dateutil(value):
+    assert service.parse_datetime(value) == parse(value)
+    assert service.parse_datetime(value).isoformat() == parse(value).isoformat()
+
+@pytest.mark.parametrize("value", DATETIME_CORPUS)
+def test_transit_datetime_is_byte_identical(value):
+    expected = dateutil_transit_datetime(value)
+    assert service.to_transit_datetime(service.parse_datetime(value)) == expected
+    assert service._convert_datetime_value(value) == expected
+
+@pytest.mark.parametrize("value", INVALID_DATETIMES)
+def test_parse_datetime_rejects_what_dateutil_rejects(value):
+    with pytest.raises(ValueError):
+        parse(value)
+    with pytest.raises(ValueError):
+        service.parse_datetime(value)
+
+@pytest.mark.parametrize("value", ["~t2024-01-01T12:00:00Z", "~t2024-01-01T12:00:00.123Z", "2024-01-01T12:00:00.000+0100"])
+def test_since_filter_matches_dateutil(value):
+    since = service.to_nontransit_datetime(value)
+    assert service.parse_datetime(since).isoformat() == parse(since).isoformat()
+
+
+class JsonResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+def csv_response(body, locator=None, compress=False):
+    '''a streamed Bulk API result page, gzipped like Salesforce does when the client accepts it'''
+    data = gzip.compress(body.encode("utf-8")) if compress else body.encode("utf-8")
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = HTTPResponse(body=io.BytesIO(data), headers={"Content-Encoding": "gzip"} if compress else {},
+        status=200, preload_content=False)
+    response.headers["Sforce-Locator"] = locator or "null"
+    return response
+
+class FakeBulkSalesforce:
+    '''answers the calls of a Bulk API 2.0 query job with the given CSV pages'''
+    bulk2_url = "https://fake.my.salesforce.com/services/data/v60.0/jobs/"
+
+    def __init__(self, pages, compress=False):
+        self.pages = pages
+        self.compress = compress
+        self.calls = []
+
+    def _call_salesforce(self, method, url, name=None, **kwargs):
+        self.calls.append((method, url, kwargs))
+        if method == "POST":
+            return JsonResponse({"id": "750job", "state": "UploadComplete", "operation": json.loads(kwargs["data"])["operation"]})
+        if url.endswith("/results"):
+            page = int(kwargs["params"].get("locator", 0))
+            locator = str(page + 1) if page + 1 < len(self.pages) else None
+            return csv_response(self.pages[page], locator, self.compress)
+        return JsonResponse({"id": "750job", "state": "JobComplete"})
+
+ACCOUNT_FIELDS = [
+    {"name": "Id", "type": "id"},
+    {"name": "Name", "type": "string"},
+    {"name": "IsDeleted", "type": "boolean"},
+    {"name": "NumberOfEmployees", "type": "int"},
+    {"name": "AnnualRevenue", "type": "currency"},
+    {"name": "Rating__c", "type": "double"},
+    {"name": "Share__c", "type": "percent"},
+    {"name": "Description", "type": "textarea"},
+    {"name": "SystemModstamp", "type": "datetime"},
+]
+
+@pytest.fixture
+def data_access():
+    data_access = service.DataAccess()
+    data_access._set_fields_metadata("Account", ACCOUNT_FIELDS)
+    return data_access
+
+@pytest.fixture(autouse=True)
+def no_bulk_job_polling(monkeypatch):
+    monkeypatch.setattr(service, "BULK_JOB_POLL_INTERVAL", 0)
+
+BULK_HEADER = "Id,Name,IsDeleted,NumberOfEmployees,AnnualRevenue,Rating__c,Share__c,Description,SystemModstamp,Owner.Name,Owner.Email,Parent.Name\n"
+
+def test_bulk_csv_rows_have_the_shape_of_rest_rows(data_access):
+    sf = FakeBulkSalesforce([BULK_HEADER +
+        '001A,"Acme, Inc.",false,12,1500.5,4.25,50,"two\nlines",2024-01-01T12:00:00.000Z,Ann,ann@example.com,\n'
+        '001B,,true,,,,,,2024-01-02T12:00:00.000Z,,,Parent Co\n'])
+    rows = list(data_access._from_csv_rows("Account", service.bulk2_query_iter(sf, "select ...")))
+    assert rows == [
+        OrderedDict([
+            ("attributes", {"type": "Account", "url": f"/services/data/v{service.API_VERSION}/sobjects/Account/001A"}),
+            ("Id", "001A"), ("Name", "Acme, Inc."), ("IsDeleted", False), ("NumberOfEmployees", 12),
+            ("AnnualRevenue", 1500.5), ("Rating__c", 4.25), ("Share__c", 50.0), ("Description", "two\nlines"),
+            ("SystemModstamp", "2024-01-01T12:00:00.000Z"), ("Owner", {"Name": "Ann", "Email": "ann@example.com"}),
+            ("Parent", None)]),
+        OrderedDict([
+            ("attributes", {"type": "Account", "url": f"/services/data/v{service.API_VERSION}/sobjects/Account/001B"}),
+            ("Id", "001B"), ("Name", None), ("IsDeleted", True), ("NumberOfEmployees", None),
+            ("AnnualRevenue", None), ("Rating__c", None), ("Share__c", None), ("Description", None),
+            ("SystemModstamp", "2024-01-02T12:00:00.000Z"), ("Owner", None), ("Parent", {"Name": "Parent Co"})]),
+    ]
+    assert isinstance(rows[0]["NumberOfEmployees"], int)
+
+def test_bulk_rows_are_sesamified_like_rest_rows(data_access):
+    sf = FakeBulkSalesforce([BULK_HEADER + "001A,Acme,false,12,1.5,,,,2024-01-01T12:00:00.000Z,,,\n"])
+    bulk_row = next(data_access._from_csv_rows("Account", service.bulk2_query_iter(sf, "select ...")))
+    rest_row = OrderedDict([("attributes", bulk_row["attributes"]), ("Id", "001A"), ("Name", "Acme"), ("IsDeleted", False),
+        ("NumberOfEmployees", 12), ("AnnualRevenue", 1.5), ("Rating__c", None), ("Share__c", None), ("Description", None),
+        ("SystemModstamp", "2024-01-01T12:00:00.000+0000"), ("Owner", None), ("Parent", None)])
+    assert data_access.sesamify(bulk_row, "Account") == data_access.sesamify(rest_row, "Account")
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_bulk_query_follows_the_locator_over_pages(data_access, compress):
+    header = "Id,IsDeleted,NumberOfEmployees\n"
+    sf = FakeBulkSalesforce([header + "001A,false,1\n001B,false,2\n", header + "001C,true,3\n", header], compress)
+    rows = list(data_access._from_csv_rows("Account", service.bulk2_query_iter(sf, "select ...", include_deleted=True)))
+    assert [(r["Id"], r["IsDeleted"], r["NumberOfEmployees"]) for r in rows] == [("001A", False, 1), ("001B", False, 2), ("001C", True, 3)]
+    assert json.loads(sf.calls[0][2]["data"])["operation"] == "queryAll"
+    result_calls = [kwargs["params"] for method, url, kwargs in sf.calls if url.endswith("/results")]
+    assert result_calls == [{"maxRecords": service.BULK_QUERY_PAGE_SIZE},
+        {"maxRecords": service.BULK_QUERY_PAGE_SIZE, "locator": "1"},
+        {"maxRecords": service.BULK_QUERY_PAGE_SIZE, "locator": "2"}]
+
+def test_failed_bulk_query_job_raises():
+    sf = FakeBulkSalesforce([])
+    sf._call_salesforce = lambda method, url, name=None, **kwargs: JsonResponse(
+        {"id": "750job", "state": "Failed", "errorMessage": "INVALID_FIELD"})
+    with pytest.raises(Exception, match="INVALID_FIELD"):
+        list(service.bulk2_query_iter(sf, "select ..."))
+
+class FakeQuerySalesforce:
+    '''answers every SOQL query with the given rows'''
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def query_all_iter(self, query):
+        self.queries.append(query)
+        return iter(self.rows)
+
+CONTACT_FIELDS = [
+    {"name": "Id", "type": "id"},
+    {"name": "Email__c", "type": "email", "caseSensitive": False},
+    {"name": "Code__c", "type": "string", "caseSensitive": True},
+    {"name": "Number__c", "type": "double"},
+]
+
+@pytest.fixture
+def contact_fields(monkeypatch):
+    data_access = service.DataAccess()
+    data_access._set_fields_metadata("Contact", CONTACT_FIELDS)
+    monkeypatch.setattr(service, "DESCRIBE_CACHE_TTL", 0)
+    monkeypatch.setattr(service, "data_access_layer", data_access)
+    monkeypatch.setattr(service, "external_id_index", None)
+
+def test_resolve_ids_matches_text_case_insensitively(contact_fields):
+    sf = FakeQuerySalesforce([{"Id": "003A", "Email__c": "Ann@Example.com"}])
+    assert service.resolve_ids(sf, "Contact", "Email__c", ["ann@example.com", "bob@example.com"]) == {"ann@example.com": "003A"}
+    assert "Email__c IN ('ann@example.com','bob@example.com')" in sf.queries[0]
+
+def test_resolve_ids_honours_case_sensitive_fields(contact_fields):
+    sf = FakeQuerySalesforce([{"Id": "003A", "Code__c": "ABC"}])
+    assert service.resolve_ids(sf, "Contact", "Code__c", ["abc", "ABC"]) == {"ABC": "003A"}
+
+def test_resolve_ids_does_not_quote_numbers(contact_fields):
+    sf = FakeQuerySalesforce([{"Id": "003A", "Number__c": 123.0}])
+    assert service.resolve_ids(sf, "Contact", "Number__c", ["123", 123, "not a number"]) == {"123": "003A", 123: "003A"}
+    assert "Number__c IN (123,123)" in sf.queries[0]
+
+def test_resolve_ids_keeps_cached_ids_that_differ_in_case_only(contact_fields, monkeypatch):
+    index = service.ExternalIdIndex(100)
+    index.put_many("Contact", "Email__c", [("ann@example.com", "003A"), ("bob@example.com", "003B")])
+    monkeypatch.setattr(service, "external_id_index", index)
+    # 003B has got another email, so bob@example.com is looked up again
+    sf = FakeQuerySalesforce([{"Id": "003A", "Email__c": "ANN@example.com"}, {"Id": "003B", "Email__c": "eve@example.com"}])
+    assert service.resolve_ids(sf, "Contact", "Email__c", ["ann@example.com", "bob@example.com"]) == {"ann@example.com": "003A"}
+    assert len(sf.queries) == 2
+    assert index.get("Contact", "Email__c", "ann@example.com") == "003A"
+    assert index.get("Contact", "Email__c", "bob@example.com") is None
+
+class ReplayAdapter(requests.adapters.BaseAdapter):
+    '''answers with the given status codes in turn and records the bodies it was sent'''
+    def __init__(self, statuses):
+        super().__init__()
+        self.statuses = list(statuses)
+        self.bodies = []
+
+    def send(self, request, **kwargs):
+        body = request.body
+        self.bodies.append(body if isinstance(body, (bytes, str)) or body is None else b"".join(body))
+        response = requests.Response()
+        response.status_code = self.statuses.pop(0)
+        response.raw = io.BytesIO(b"")
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+def test_retried_upload_streams_the_body_factory_again():
+    session = service.ThrottledSession(service.ApiScheduler(4), retry_max=2, retry_backoff=0)
+    adapter = ReplayAdapter([503, 200])
+    session.mount("https://", adapter)
+    calls = []
+
+    def body():
+        calls.append(1)
+        return service._iter_csv_chunks(["Id", "Name"], iter([{"Id": "001A", "Name": "Acme"}]), chunk_size=4)
+
+    assert session.request("PUT", "https://fake.my.salesforce.com/services/data/v60.0/jobs/ingest/750/batches", data=body).status_code == 200
+    assert adapter.bodies == [b"Id,Name\n001A,Acme\n"] * 2
+    assert len(calls) == 2
+
+class SessionAdapter(requests.adapters.BaseAdapter):
+    '''answers 401 INVALID_SESSION_ID unless the call was sent with the valid token. The first calls all wait for each
+        other and their 401s arrive one after the other, so later threads reach the refresh after earlier ones logged in.'''
+    def __init__(self, threads):
+        super().__init__()
+        self.valid_token = "token1"
+        self.barrier = threading.Barrier(threads)
+        self.lock = threading.Lock()
+        self.failed = 0
+
+    def send(self, request, **kwargs):
+        response = requests.Response()
+        response.request = request
+        if request.headers["Authorization"] == "Bearer " + self.valid_token:
+            response.status_code = 200
+            response.raw = io.BytesIO(b"{}")
+            return response
+        self.barrier.wait()
+        with self.lock:
+            self.failed += 1
+            delay = self.failed * 0.02
+        time.sleep(delay)
+        response.status_code = 401
+        response.raw = io.BytesIO(b'[{"errorCode": "INVALID_SESSION_ID", "message": "Session expired or invalid"}]')
+        return response
+
+    def close(self):
+        pass
+
+def test_concurrent_401s_on_the_same_session_log_in_once():
+    threads = 6
+    session = service.ThrottledSession(service.ApiScheduler(threads), retry_max=0)
+    adapter = SessionAdapter(threads)
+    session.mount("https://", adapter)
+    sf = service.SalesforceService(instance="fake.my.salesforce.com", session_id="expired", session=session)
+    logins = []
+
+    def login():
+        logins.append(1)
+        time.sleep(0.01)
+        return adapter.valid_token, "fake.my.salesforce.com"
+    sf._salesforce_login_partial = login
+
+    results = []
+    workers = [threading.Thread(target=lambda: results.append(sf._call_salesforce("GET", sf.base_url + "limits").status_code))
+        for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert results == [200] * threads
+    assert len(logins) == 1
+
+def parse_json_array(data, read_size=65536):
+    return list(service.iter_json_array(io.BytesIO(data), read_size))
+
+NESTED_ARRAY = b' [ {"_id": "a", "values": [1, [2, {"x": "]"}]], "n": -12.5e3},\n {"_id": "b\\u00e6\xc3\xb8", "ok": true}, 1234567, null ] '
+
+@pytest.mark.parametrize("read_size", [1, 2, 3, 7, 65536])
+def test_json_array_is_parsed_across_reads(read_size):
+    assert parse_json_array(NESTED_ARRAY, read_size) == json.loads(NESTED_ARRAY)
+
+@pytest.mark.parametrize("read_size", [1, 2, 3, 4])
+def test_numbers_split_by_reads_are_not_cut(read_size):
+    assert parse_json_array(b"[12345,-6.75e2,0]", read_size) == [12345, -675.0, 0]
+    assert parse_json_array(b"123456", read_size) == [123456]
+
+def test_json_value_that_is_not_an_array_is_the_only_item():
+    assert parse_json_array(b'{"_id": "a"}', 1) == [{"_id": "a"}]
+
+@pytest.mark.parametrize("data", [b"", b" \n "])
+def test_empty_body_has_no_items(data):
+    assert parse_json_array(data) == []
+
+@pytest.mark.parametrize("data", [b"[1,]", b"[1,2", b"[1 2]", b"[", b'[{"_id": "a"]', b"[1] x", b"[] []", b"1 2"])
+def test_malformed_json_array_raises(data):
+    with pytest.raises(ValueError):
+        parse_json_array(data, 1)
+
+@pytest.fixture
+def receiver_client(monkeypatch):
+    monkeypatch.setenv("LOGIN_CONFIG", "{}")
+    monkeypatch.setattr(service, "get_sf", lambda: type("FakeSalesforce", (), {"Account": True})())
+    monkeypatch.setattr(service, "RECEIVER_CHUNK_SIZE", 1)
+    monkeypatch.setattr(service, "DEFAULT_BULK_SWITCH_THRESHOLD", 0)
+    written = []
+    monkeypatch.setattr(service, "transform", lambda datatype, chunk, sf, **kwargs: written.extend(chunk))
+    return service.app.test_client(), written
+
+def test_malformed_body_is_a_bad_request_after_the_chunks_before_it(receiver_client):
+    client, written = receiver_client
+    response = client.post("/Account", data=b'[{"_id": "a"}, {"_id": "b"}, {"_id": ]')
+    assert response.status_code == 400
+    assert written == [{"_id": "a"}, {"_id": "b"}]
+
+@pytest.mark.parametrize("entity_count", ["many", "-1", "1.5"])
+def test_invalid_entity_count_is_a_bad_request_before_anything_is_written(receiver_client, entity_count):
+    client, written = receiver_client
+    response = client.post("/Account", data=b'[{"_id": "a"}]', headers={"X-Entity-Count": entity_count})
+    assert response.status_code == 400
+    assert written == []
+
+def test_bulk_query_job_closed_before_the_last_page_is_deleted():
+    header = "Id,IsDeleted\n"
+    sf = FakeBulkSalesforce([header + "001A,false\n001B,false\n", header + "001C,false\n"])
+    rows = service.bulk2_query_iter(sf, "select ...")
+    assert next(rows)["Id"] == "001A"
+    rows.close()
+    assert sf.calls[-1][:2] == ("DELETE", sf.bulk2_url + "query/750job")
+
+def test_bulk_query_job_read_to_the_end_is_left_alone():
+    sf = FakeBulkSalesforce(["Id\n001A\n"])
+    assert [row["Id"] for row in service.bulk2_query_iter(sf, "select ...")] == ["001A"]
+    assert [method for method, url, kwargs in sf.calls] == ["POST", "GET", "GET"]
+
+def test_bulk_query_job_is_aborted_if_waiting_for_it_fails():
+    sf = FakeBulkSalesforce([])
+    calls = []
+
+    def call_salesforce(method, url, name=None, **kwargs):
+        calls.append((method, kwargs.get("data")))
+        if method == "POST":
+            return JsonResponse({"id": "750job", "state": "UploadComplete"})
+        if method == "GET":
+            raise requests.ConnectionError("connection reset")
+        return JsonResponse({"id": "750job", "state": "Aborted"})
+    sf._call_salesforce = call_salesforce
+    with pytest.raises(requests.ConnectionError):
+        list(service.bulk2_query_iter(sf, "select ..."))
+    assert calls[-1] == ("PATCH", json.dumps({"state": "Aborted"}))
+    assert len(calls) == 3
+
+class FakeCollectionsSalesforce:
+    '''answers sObject Collections requests, the records or Ids in errors fail with the given errors'''
+    def __init__(self, errors=None):
+        self.errors = errors or {}
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def restful(self, path, params=None, method="GET", json=None):
+        keys = params["ids"].split(",") if method == "DELETE" else [r.get("Id") or r.get("Name") for r in json["records"]]
+        with self.lock:
+            self.calls.append((method, path, keys))
+        return [{"success": False, "errors": self.errors[k]} if k in self.errors else {"success": True, "id": k} for k in keys]
+
+@pytest.fixture
+def no_external_id_index(monkeypatch):
+    monkeypatch.setattr(service, "external_id_index", None)
+
+def test_writes_to_the_same_record_keep_their_order(no_external_id_index):
+    sf = FakeCollectionsSalesforce()
+    writes = [("update", "Id", "001A", {"Id": "001A", "Name": "a"}), ("update", "Id", "001B", {"Id": "001B", "Name": "b"}),
+        ("delete", "Id", "001A", "001A"), ("update", "Id", "001A", {"Id": "001A", "Name": "a2"})]
+    assert [[w[2] for w in r] for r in service._split_by_unique_key(writes)] == [["001A", "001B"], ["001A"], ["001A"]]
+    assert service.write_in_collections(sf, "Account", writes) == []
+    assert [(method, keys) for method, path, keys in sf.calls] == [("PATCH", ["001A", "001B"]), ("DELETE", ["001A"]), ("PATCH", ["001A"])]
+
+def test_writes_are_split_into_collections_of_200(no_external_id_index):
+    sf = FakeCollectionsSalesforce()
+    writes = [("create", "Id", f"new-{i}", {"Name": f"n{i}"}) for i in range(450)]
+    assert service.write_in_collections(sf, "Account", writes) == []
+    assert sorted(len(keys) for method, path, keys in sf.calls) == [50, 200, 200]
+    assert sorted(k for method, path, keys in sf.calls for k in keys) == sorted(f"n{i}" for i in range(450))
+
+def test_failed_writes_are_reported_per_objectkey(no_external_id_index):
+    errors = [{"statusCode": "FIELD_CUSTOM_VALIDATION_EXCEPTION", "message": "invalid", "fields": []}]
+    sf = FakeCollectionsSalesforce({"001B": errors, "001C": errors})
+    writes = [("update", "Id", f"key-{k}", {"Id": k}) for k in ["001A", "001B"]] + [("delete", "Id", "key-001C", "001C")]
+    assert service.write_in_collections(sf, "Account", writes) == [
+        {"objectkey": "key-001B", "operation": "update", "errors": errors},
+        {"objectkey": "key-001C", "operation": "delete", "errors": errors}]
+
+def test_deleting_an_already_deleted_record_is_not_a_failure(no_external_id_index):
+    sf = FakeCollectionsSalesforce({
+        "001A": [{"statusCode": "ENTITY_IS_DELETED", "message": "entity is deleted", "fields": []}],
+        "001B": [{"statusCode": "INVALID_CROSS_REFERENCE_KEY", "message": "invalid cross reference id", "fields": []}],
+        "001C": [{"statusCode": "DELETE_FAILED", "message": "in use", "fields": []}]})
+    writes = [("delete", "Id", k, k) for k in ["001A", "001B", "001C", "001D"]]
+    assert [f["objectkey"] for f in service.write_in_collections(sf, "Account", writes)] == ["001C"]
+    assert service.is_already_deleted("ENTITY_IS_DELETED:entity is deleted:--")
+    assert not service.is_already_deleted([])
+
+def test_include_and_exclude_fields_are_case_insensitive(data_access, monkeypatch):
+    monkeypatch.setattr(service, "SF_OBJECTS_CONFIG", {"Account": {"include_fields": ["name", "NUMBEROFEMPLOYEES", "description"]}})
+    assert [f["name"] for f in data_access._get_selected_fields("Account")] == ["Id", "Name", "IsDeleted", "NumberOfEmployees",
+        "Description", "SystemModstamp"]
+    monkeypatch.setattr(service, "SF_OBJECTS_CONFIG", {"Account": {"exclude_fields": ["rating__C", "share__c"], "skip_large_fields": False}})
+    assert [f["name"] for f in data_access._get_selected_fields("Account")] == ["Id", "Name", "IsDeleted", "NumberOfEmployees",
+        "AnnualRevenue", "Description", "SystemModstamp"]